@@ -4,10 +4,13 @@ import os
 from argparse import ArgumentParser
 import shlex
 import pandas as pd
+import numpy as np
 from getpass import getpass
-from nexusbjj.db import Database, QueryResult
-from datetime import datetime, timedelta
-from numpy.random import randint
+from time import perf_counter
+from nexusbjj.backends import SQLiteBackend
+from nexusbjj.db import Database
+from datetime import datetime
+from werkzeug.security import generate_password_hash
 import calendar
 from nexusbjj.email import Email
 from flask.cli import with_appcontext
@@ -23,11 +26,17 @@ def get_args():
     parser.add_argument('-i', '--user-id', type=int, help='ID of user')
     parser.add_argument('-e', '--execute-script', help='Execute SQL script')
     parser.add_argument('-q', '--query', help='Execute custom query')
+    parser.add_argument('--add-users', type=int, help='Add random members')
+    parser.add_argument('--add-classes', type=int, help='Add random classes per weekday to the timetable')
     parser.add_argument('--add-attendances', type=int, help='Add random attendances')
+    parser.add_argument('--years', type=float, default=2, help='Spread random attendances over this many years up to today')
+    parser.add_argument('--seed', type=int, help='Seed for the random data, for reproducible data sets')
+    parser.add_argument('--batch-size', type=int, default=50000, help='Rows inserted per transaction')
     parser.add_argument('--commit', action='store_true', help='Commit query changes to database')
     parser.add_argument('--db-user', default='webapp', help='Database user')
     parser.add_argument('--db-pass', help='Password to login to database')
     parser.add_argument('--db-host', help='IP address of database')
+    parser.add_argument('--sqlite', help='Path of a SQLite database to use instead of MySQL')
     parser.add_argument('--reset-password', action='store_true', help='Reset password for user')
     parser.add_argument('--test-email-to', default='jono.nicholas@hotmail.co.uk', help='Test email connectivity')
 
@@ -74,6 +83,102 @@ def print_results(rows, err_message='No results returned'):
         print(err_message)
 
 
+def insert_rows(db, query, rows, batch_size=50000):
+    # executemany sends each batch as one multi-row INSERT, committed as one transaction
+    for start in range(0, len(rows), batch_size):
+        db.executemany(query, rows[start:start + batch_size])
+        db.commit()
+
+
+def generate_users(db, rng, count, batch_size=50000):
+    db.execute('SELECT COALESCE(MAX(id), 0) max_id FROM users')
+    first_id = db.cursor.fetchone()['max_id'] + 1
+    db.execute('SELECT id FROM memberships')
+    membership_ids = np.array([row['id'] for row in db.cursor.fetchall()])
+    # Hashing is deliberately slow, so every generated member shares the same password
+    password = generate_password_hash('password')
+    numbers = np.arange(first_id, first_id + count)
+    memberships = rng.choice(membership_ids, size=count, p=get_membership_weights(len(membership_ids)))
+    created = np.datetime64(datetime.today(), 's') - rng.integers(0, 3 * 365, size=count).astype('timedelta64[D]')
+    rows = list(zip((f'member{n}@example.com' for n in numbers), [password] * count, ['Member'] * count,
+                    numbers.astype(str).tolist(), (f'07{n:09d}' for n in numbers), memberships.tolist(),
+                    ['no'] * count, created.tolist()))
+    query = 'INSERT INTO users (email, password, first_name, last_name, mobile_number, membership_id, admin, created) '
+    query += 'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)'
+    insert_rows(db, query, rows, batch_size)
+    return count
+
+
+def get_membership_weights(count):
+    # Most members are on the cheaper plans
+    weights = np.arange(count, 0, -1, dtype=float)
+    return weights / weights.sum()
+
+
+def generate_classes(db, rng, per_weekday):
+    coaches = db.get_coaches()
+
+    if not coaches:
+        print('Add a coach before generating classes.')
+        return 0
+
+    coach_ids = np.array([coach['id'] for coach in coaches])
+    age_group_ids = np.array([row['id'] for row in db.get_age_groups()] or [1])
+    rows = []
+
+    for weekday in range(len(calendar.day_name)):
+        hours = np.sort(rng.choice(np.arange(6, 22), size=min(per_weekday, 16), replace=False))
+        class_types = rng.choice(['Gi', 'No Gi'], size=len(hours))
+        rows.extend(zip([f'{class_type} {hour:02d}:00' for class_type, hour in zip(class_types, hours)], class_types.tolist(),
+                        [weekday] * len(hours), [f'{hour:02d}:00:00' for hour in hours], [f'{hour + 1:02d}:00:00' for hour in hours],
+                        rng.choice(coach_ids, size=len(hours)).tolist(), rng.choice(age_group_ids, size=len(hours)).tolist()))
+
+    query = 'INSERT INTO classes (class_name, class_type, weekday, time, end_time, coach_id, age_group_id) VALUES (%s, %s, %s, %s, %s, %s, %s)'
+    insert_rows(db, query, rows)
+    db.update_unlimited_class_count()
+    return len(rows)
+
+
+def generate_attendances(db, rng, count, years=2, batch_size=50000):
+    db.execute('SELECT id, weekday, time FROM classes')
+    classes = db.cursor.fetchall()
+    db.execute('SELECT id FROM users WHERE is_coach = false')
+    user_ids = np.array([row['id'] for row in db.cursor.fetchall()])
+
+    if not classes or not len(user_ids):
+        print('Add users and classes before generating attendances.')
+        return 0
+
+    class_ids = np.array([cls['id'] for cls in classes])
+    class_weekdays = np.array([cls['weekday'] for cls in classes])
+    class_times = np.array([int(cls['time'].total_seconds()) for cls in classes]).astype('timedelta64[s]')
+
+    # A skewed propensity per member gives a realistic mix of regulars and occasional attendees
+    user_weights = rng.gamma(shape=1.5, size=len(user_ids))
+    users = rng.choice(len(user_ids), size=count, p=user_weights / user_weights.sum())
+    sessions = rng.integers(0, len(classes), size=count)
+
+    today = np.datetime64(datetime.today().date(), 'D')
+    # The epoch fell on a Thursday, so this is the Monday of the current week
+    this_week = today - (today.astype(int) + 3) % 7
+    weeks = max(int(years * 52), 1)
+    class_dates = this_week - rng.integers(0, weeks, size=count).astype('timedelta64[W]') + class_weekdays[sessions].astype('timedelta64[D]')
+    class_datetimes = class_dates.astype('datetime64[s]') + class_times[sessions]
+    # Members check in up to half an hour before the class starts
+    check_ins = class_datetimes - rng.integers(0, 30 * 60, size=count).astype('timedelta64[s]')
+
+    # Drop future classes and repeat check-ins to the same class
+    keys = np.stack([user_ids[users], class_ids[sessions], class_dates.astype(int)], axis=1)
+    past = np.flatnonzero(check_ins <= np.datetime64(datetime.now(), 's'))
+    unique = past[np.unique(keys[past], axis=0, return_index=True)[1]]
+
+    rows = list(zip(user_ids[users[unique]].tolist(), class_ids[sessions[unique]].tolist(), class_dates[unique].tolist(),
+                    class_times[sessions[unique]].tolist(), check_ins[unique].tolist()))
+    query = 'INSERT INTO attendance (user_id, class_id, class_date, class_time, date) VALUES (%s, %s, %s, %s, %s)'
+    insert_rows(db, query, rows, batch_size)
+    return len(rows)
+
+
 def test_email(to):
     config = get_config()
     msg = Email(to=to, text_body='This is a test', user=config['SMTP_USER'], passwd=config['SMTP_PASS'])
@@ -82,7 +187,11 @@ def test_email(to):
 
 if __name__ == '__main__':
     args = get_args()
-    db = Database(**get_database_details(args.db_host, args.db_user, args.db_pass))
+    if args.sqlite:
+        db = Database(db_name=args.sqlite, backend=SQLiteBackend())
+    else:
+        db = Database(**get_database_details(args.db_host, args.db_user, args.db_pass))
+    rng = np.random.default_rng(args.seed)
 
     try:
         user = db.get_user(uid=args.user_id, email=args.email)
@@ -104,33 +213,20 @@ if __name__ == '__main__':
             db.executescript(f.read())
         print('Database updated.')
         
+    if args.add_users:
+        started = perf_counter()
+        added = generate_users(db, rng, args.add_users, args.batch_size)
+        print(f'Added {added} users in {perf_counter() - started:.1f}s')
+
+    if args.add_classes:
+        added = generate_classes(db, rng, args.add_classes)
+        print(f'Added {added} classes')
+
     if args.add_attendances:
-        classes = QueryResult(db.get_all_classes())
-        users = QueryResult(db.get_users(('id',)))
-        query = 'INSERT INTO attendance (user_id, class_id, class_date, class_time, date) VALUES (%s, %s, %s, %s, %s);'
-        results = QueryResult()
-        
-        for idx in range(args.add_attendances):
-            user_id = users.sample().to_dict('records')[0]['id']
-            _class = classes.sample().to_dict('records')[0]
-            attendance_date = datetime(year=randint(2021, 2023), month=randint(1, 13), day=randint(1, 29),
-                                       hour=randint(0, 24), minute=randint(0, 60), second=randint(0, 60))
-            weekday = _class['weekday']
-            
-            if attendance_date.strftime('%A') != weekday:
-                attendance_date = attendance_date + timedelta(days=(list(calendar.day_name).index(weekday) -
-                                                              attendance_date.weekday()))
-            if attendance_date > datetime.today():
-                attendance_date = attendance_date - timedelta(days=365)
-            
-            params = (user_id, _class['class_id'], attendance_date.date(), _class['class_time'], attendance_date)
-            db.execute(query, params)
-            db.commit()
-            _class['user'] = user_id
-            _class['attended'] = attendance_date.isoformat()
-            results = pd.concat([results, QueryResult(_class, index=[0])], ignore_index=True)
-        
-        print(results)
+        started = perf_counter()
+        added = generate_attendances(db, rng, args.add_attendances, args.years, args.batch_size)
+        db.rebuild_attendance_rollups()
+        print(f'Added {added} attendances in {perf_counter() - started:.1f}s')
 
     if args.reset_password:
         if user:
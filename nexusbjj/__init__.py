@@ -19,6 +19,12 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app)
 
+    from . import email
+    email.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
     from nexusbjj.routes import auth
     app.register_blueprint(auth.bp)
 
@@ -0,0 +1,301 @@
+import mysql.connector
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+
+
+class MySQLBackend:
+    name = 'mysql'
+    schema_script = 'schema.sql'
+    explain_prefix = 'EXPLAIN '
+
+    def connect(self, **connect_args):
+        return mysql.connector.connect(**connect_args)
+
+    def get_schema(self, db):
+        query = 'SELECT table_name AS table_name, column_name AS column_name FROM information_schema.columns '
+        query += 'WHERE table_schema = %s ORDER BY table_name, ordinal_position'
+        params = (db.db_name,)
+        db.execute(query, params)
+        schema = {}
+
+        for row in db.cursor.fetchall():
+            table = schema.setdefault(row['table_name'], {'columns': [], 'indexes': {}})
+            table['columns'].append(row['column_name'])
+
+        query = 'SELECT table_name AS table_name, index_name AS index_name, column_name AS column_name '
+        query += 'FROM information_schema.statistics WHERE table_schema = %s ORDER BY table_name, index_name, seq_in_index'
+        db.execute(query, params)
+
+        for row in db.cursor.fetchall():
+            table = schema.setdefault(row['table_name'], {'columns': [], 'indexes': {}})
+            table['indexes'].setdefault(row['index_name'], []).append(row['column_name'])
+
+        return schema
+
+    def describe_plan(self, plan):
+        return [{'table': step.get('table'), 'key': step.get('key'), 'rows': step.get('rows')} for step in plan]
+
+    def replica_lag(self, connection):
+        # Seconds the replica's applier is behind its source, or None when replication is stopped or not configured
+        cursor = connection.cursor(dictionary=True)
+
+        try:
+            try:
+                cursor.execute('SHOW REPLICA STATUS')
+            except mysql.connector.Error:
+                # Servers before MySQL 8.0.22 only know the old name
+                cursor.execute('SHOW SLAVE STATUS')
+            status = cursor.fetchone()
+        finally:
+            cursor.close()
+
+        if status is None:
+            return None
+        return status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+    schema_script = 'schema_sqlite.sql'
+    explain_prefix = 'EXPLAIN QUERY PLAN '
+
+    def connect(self, database, **ignored):
+        return SQLiteConnection(database)
+
+    def get_schema(self, db):
+        db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        schema = {}
+
+        for table_name in [row['name'] for row in db.cursor.fetchall()]:
+            table = schema.setdefault(table_name, {'columns': [], 'indexes': {}})
+            db.execute(f'PRAGMA table_info({table_name})')
+            columns = db.cursor.fetchall()
+            table['columns'] = [column['name'] for column in columns]
+            primary_key = sorted((column for column in columns if column['pk']), key=lambda column: column['pk'])
+            if primary_key:
+                table['indexes']['PRIMARY'] = [column['name'] for column in primary_key]
+
+            db.execute(f'PRAGMA index_list({table_name})')
+            for index in db.cursor.fetchall():
+                db.execute(f'PRAGMA index_info({index["name"]})')
+                table['indexes'][index['name']] = [column['name'] for column in db.cursor.fetchall()]
+
+        return schema
+
+    def describe_plan(self, plan):
+        steps = []
+
+        for step in plan:
+            match = re.match(r'(?:SCAN|SEARCH) (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+)| USING (INTEGER PRIMARY KEY))?',
+                             step['detail'])
+            if match:
+                table, index, primary_key = match.groups()
+                steps.append({'table': table, 'key': index or primary_key, 'rows': None})
+
+        return steps
+
+    def replica_lag(self, connection):
+        # A read-only copy of the database file is never behind
+        return 0
+
+
+BACKENDS = {
+    'mysql': MySQLBackend,
+    'sqlite': SQLiteBackend
+}
+
+
+def get_backend(name='mysql'):
+    return BACKENDS[name]()
+
+
+# SQLite adapters: present a sqlite3 connection through the subset of the MySQL connector API that Database uses
+
+
+class SQLiteConnection:
+    unread_result = False
+
+    def __init__(self, database):
+        self.connection = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.create_function('DATE_FORMAT', 2, date_format, deterministic=True)
+        self.connection.create_function('ADDTIME', 2, add_time, deterministic=True)
+        self.connection.create_function('CONCAT', -1, concat, deterministic=True)
+        self.connection.create_function('WEEKDAY', 1, weekday, deterministic=True)
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self.connection, dictionary)
+
+    @property
+    def in_transaction(self):
+        return self.connection.in_transaction
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+    def is_connected(self):
+        return True
+
+    def reconnect(self, attempts=1):
+        pass
+
+    def reset_session(self):
+        pass
+
+    def consume_results(self):
+        pass
+
+
+class SQLiteCursor:
+    def __init__(self, connection, dictionary=False):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.dictionary = dictionary
+        self.rows_fetched = 0
+
+    def execute(self, query, params=(), multi=False):
+        self.rows_fetched = 0
+        if multi:
+            self.connection.executescript(translate_sql(query))
+            return None
+
+        self.cursor.execute(translate_sql(query), translate_params(params or ()))
+
+    def executemany(self, query, seq_params):
+        self.rows_fetched = 0
+        self.cursor.executemany(translate_sql(query), [translate_params(params) for params in seq_params])
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self.cursor.description or ())
+
+    @property
+    def rowcount(self):
+        # sqlite3 reports -1 for SELECT statements, whereas MySQL counts the rows read so far
+        return self.cursor.rowcount if self.cursor.rowcount != -1 else self.rows_fetched
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def make_row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        self.rows_fetched += row is not None
+        return self.make_row(row)
+
+    def fetchmany(self, size=1):
+        rows = self.cursor.fetchmany(size)
+        self.rows_fetched += len(rows)
+        return [self.make_row(row) for row in rows]
+
+    def fetchall(self):
+        if self.cursor.description is None:
+            return []
+        rows = self.cursor.fetchall()
+        self.rows_fetched += len(rows)
+        return [self.make_row(row) for row in rows]
+
+    def close(self):
+        self.cursor.close()
+
+
+def translate_sql(query):
+    # Rewrite the MySQL dialect used by Database: %s placeholders, double-quoted strings and a few statements
+    translated = ''
+    position = 0
+
+    for match in re.finditer(r"'(?:[^']|'')*'|\"((?:[^\"]|\"\")*)\"|%s", query):
+        translated += query[position:match.start()]
+        if match.group(0) == '%s':
+            translated += '?'
+        elif match.group(0).startswith('"'):
+            translated += "'" + match.group(1).replace('""', '"').replace("'", "''") + "'"
+        else:
+            translated += match.group(0)
+        position = match.end()
+
+    translated += query[position:]
+    translated = re.sub(r'DATE_SUB\((.+?), INTERVAL (.+?) DAY\)', r"date(\1, '-' || (\2) || ' days')", translated)
+    translated = re.sub(r'\s+FOR UPDATE\s*$', '', translated)
+
+    if 'ON DUPLICATE KEY UPDATE' in translated:
+        insert, update = translated.split('ON DUPLICATE KEY UPDATE')
+        translated = insert + 'ON CONFLICT DO UPDATE SET' + re.sub(r'VALUES\((\w+)\)', r'excluded.\1', update)
+
+    return translated
+
+
+def translate_params(params):
+    # MySQL accepts 'YYYY-MM-DDTHH:MM:SS' strings but SQLite compares them as text against space-separated values
+    return tuple(re.sub(r'^(\d{4}-\d{2}-\d{2})T', r'\1 ', param) if isinstance(param, str) else param for param in params)
+
+
+def parse_time(value) -> timedelta:
+    if isinstance(value, bytes):
+        value = value.decode()
+    hours, minutes, *seconds = str(value).split(':')
+    return timedelta(hours=int(hours), minutes=int(minutes), seconds=float(seconds[0]) if seconds else 0)
+
+
+def format_time(value: timedelta) -> str:
+    seconds = int(value.total_seconds())
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def parse_temporal(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if re.match(r'^\d{1,3}:\d{2}', value):
+        return datetime(1900, 1, 1) + parse_time(value)
+    return datetime.fromisoformat(value)
+
+
+MYSQL_DATE_FORMATS = {'%i': '%M', '%s': '%S', '%T': '%H:%M:%S', '%e': '%d', '%W': '%A', '%M': '%B', '%h': '%I'}
+
+
+def date_format(value, mysql_format):
+    value = parse_temporal(value)
+    if value is None:
+        return None
+    python_format = re.sub(r'%[a-zA-Z]', lambda code: MYSQL_DATE_FORMATS.get(code.group(0), code.group(0)), mysql_format)
+    return value.strftime(python_format)
+
+
+def add_time(value, duration):
+    if value is None or duration is None:
+        return None
+    if re.match(r'^\d{1,3}:\d{2}', value):
+        return format_time(parse_time(value) + parse_time(duration))
+    return (datetime.fromisoformat(value) + parse_time(duration)).isoformat(' ')
+
+
+def concat(*values):
+    if any(value is None for value in values):
+        return None
+    return ''.join(str(value) for value in values)
+
+
+def weekday(value):
+    return parse_temporal(value).weekday() if value is not None else None
+
+
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(timedelta, format_time)
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()[:10]))
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('TIME', parse_time)
@@ -1,36 +1,161 @@
-import mysql.connector
+from mysql.connector.errors import PoolError
 import click
-from flask import current_app, g, flash
+from flask import current_app, g, flash, has_request_context, session
 from flask.cli import with_appcontext
 from os.path import dirname, basename
 import os
+import atexit
+import functools
+import json
+import logging
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_left
+from calendar import day_name
+from collections import Counter
+from contextlib import contextmanager
+import queue
+import re
+import threading
 from werkzeug.utils import secure_filename
 from shutil import rmtree
 from getpass import getpass
 from werkzeug.security import check_password_hash, generate_password_hash
-from pandas import DataFrame
-from datetime import time, timedelta, datetime
-from time import localtime, strftime
+from nexusbjj.backends import MySQLBackend, get_backend
+from nexusbjj.cache import TTLCache
+from nexusbjj.metrics import metrics, normalise_sql
+from datetime import date, time, timedelta, datetime
+from time import localtime, strftime, perf_counter, monotonic, sleep
+
+
+logger = logging.getLogger(__name__)
+ATTENDANCE_COLUMNS = {
+    'class_name': 'classes.class_name',
+    'class_date': 'class_date',
+    'class_time': 'DATE_FORMAT(class_time, "%H:%i") class_time',
+    'class_id': 'class_id',
+    'user_id': 'user_id',
+    'full_name': 'CONCAT(users.first_name, " ", users.last_name) AS full_name',
+    'membership_type': 'membership_type',
+    'check_in_time': 'date AS check_in_time'
+}
+SESSION_USER_COLUMNS = ('id', 'email', 'first_name', 'last_name', 'mobile_number', 'grade', 'membership_id', 'admin',
+                        'created', 'is_coach')
+USER_COLUMNS = SESSION_USER_COLUMNS + ('last_access',)
+# Keyset pagination orders by these columns; each list ends with a unique column and is backed by an index
+USER_SORT_COLUMNS = {
+    'last_name': ('users.last_name', 'users.first_name', 'users.id'),
+    'last_access': ('users.last_access', 'users.id'),
+    'id': ('users.id',)
+}
+ATTENDANCE_SORT_COLUMNS = {
+    'class': ('attendance.class_date', 'attendance.class_time', 'attendance.id'),
+    'check_in_time': ('attendance.date', 'attendance.id')
+}
+
+
+def replica_read(method):
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        with self.reading():
+            return method(self, *args, **kwargs)
+
+    return wrapped
 
 
 class Database:
-    def __init__(self, db_name='nexusbjj', db_host=None, db_user=None, db_pass=None):
+    def __init__(self, db_name='nexusbjj', db_host=None, db_user=None, db_pass=None, pool=None, backend=None, replica_pool=None):
         self.db_name = db_name
-        self.db = self.connect(db_host, db_user, db_pass)
+        self.pool = pool
+        self.backend = pool.backend if pool else (backend if backend else MySQLBackend())
+        self.db = pool.get_connection() if pool else self.connect(db_host, db_user, db_pass)
         self.cursor = self.db.cursor(dictionary=True)
-        self.execute = self.cursor.execute
-        self.commit = self.db.commit
-        self.close = self.db.close
-        self.executemany = self.cursor.executemany
+        self.replica_pool = replica_pool
+        self.replica = None
+        self.replica_cursor = None
+        self.wrote = False
+        self._reading = False
+        self.statement_count = 0
+        self._pending_statement = None
         self.challenge_parent_folder = 'challenges'
-        self.check_schema()
+
+    def commit(self):
+        self.db.commit()
+        self.wrote = True
+
+    def execute(self, query, params=None, multi=False):
+        self.finish_statement()
+        start = perf_counter()
+        result = self.cursor.execute(query, params, multi=True) if multi else self.cursor.execute(query, params)
+        self.start_statement(query, params, perf_counter() - start)
+        return result
+
+    def executemany(self, query, seq_params):
+        self.finish_statement()
+        start = perf_counter()
+        result = self.cursor.executemany(query, seq_params)
+        self.start_statement(query, None, perf_counter() - start)
+        return result
+
+    def start_statement(self, query, params, seconds):
+        self.statement_count += 1
+        self._pending_statement = (query, params, seconds)
+
+    def finish_statement(self):
+        # The row count is only known once the caller has read the result, so a statement is recorded when the next one starts
+        if self._pending_statement is None:
+            return
+
+        query, params, seconds = self._pending_statement
+        self._pending_statement = None
+        self.record_statement(query, params, seconds, self.cursor.rowcount)
+
+    def record_statement(self, query, params, seconds, rows):
+        metrics.record_statement(query, seconds, rows)
+
+        if seconds >= metrics.slow_query_seconds:
+            self.log_slow_query(query, params, seconds)
+
+    def log_slow_query(self, query, params, seconds):
+        plan = None
+
+        if query.lstrip().upper().startswith('SELECT'):
+            cursor = self.db.cursor(dictionary=True)
+            try:
+                cursor.execute(self.backend.explain_prefix + query, params)
+                plan = self.backend.describe_plan(cursor.fetchall())
+            except Exception as e:
+                plan = f'unavailable ({e})'
+            finally:
+                cursor.close()
+
+        # Parameters are left out: they include password hashes and reset tokens
+        logger.warning(f'Slow query ({1000 * seconds:.0f}ms): {normalise_sql(query)} plan={plan}')
+
+    def close(self):
+        self.db.consume_results()
+        self.finish_statement()
+        self.cursor.close()
+
+        if self.replica is not None:
+            self.replica.consume_results()
+            self.replica_cursor.close()
+            self.replica_pool.release(self.replica)
+
+        if self.pool:
+            self.pool.release(self.db)
+        else:
+            self.db.close()
 
     def connect(self, db_host=None, db_user=None, db_pass=None):
+        if self.backend.name == 'sqlite':
+            # db_name is the path of the database file
+            return self.backend.connect(database=self.db_name)
+
         db_host = db_host if db_host else current_app.config['DATABASE_HOST']
         db_user = db_user if db_user else current_app.config['DATABASE_USER']
         db_pass = db_pass if db_pass else (current_app.config['DATABASE_PASS']\
              if current_app.config['DATABASE_PASS'] else getpass('Enter database password: '))
-        connection = mysql.connector.connect(
+        connection = self.backend.connect(
             host=db_host,
             user=db_user,
             password=db_pass,
@@ -47,15 +172,101 @@ class Database:
                 print(result)
         self.commit()
 
-    def check_schema(self):
-        query = 'SELECT table_name FROM information_schema.tables WHERE table_schema = %s'
-        params = ('nexusbjj',)
+    def read_connection(self):
+        # Reads stay on the primary once this request has written, and while the replica is unreachable or lagging
+        if self.replica_pool is None or self.wrote:
+            return self.db
+
+        if self.replica is None:
+            if not self.replica_pool.available():
+                return self.db
+
+            try:
+                self.replica = self.replica_pool.get_connection()
+            except Exception as e:
+                logger.warning(f'Read replica unavailable, reading from the primary: {e}')
+                self.replica_pool.mark_unavailable()
+                return self.db
+
+            self.replica_cursor = self.replica.cursor(dictionary=True)
+
+        if not self.replica_pool.is_current(self.replica):
+            return self.db
+
+        return self.replica
+
+    @contextmanager
+    def reading(self):
+        # Run the enclosed queries on the read replica, when there is one that is fit to use
+        connection = self.db if self._reading else self.read_connection()
+
+        if connection is self.db:
+            yield
+            return
+
+        self.finish_statement()
+        primary = (self.db, self.cursor)
+        self.db, self.cursor = self.replica, self.replica_cursor
+        self._reading = True
+        try:
+            yield
+        finally:
+            self.finish_statement()
+            self.db, self.cursor = primary
+            self._reading = False
+
+    @contextmanager
+    def explaining(self, plans):
+        # Run the enclosed queries as EXPLAIN statements and collect their plans instead of their results
+        execute = self.execute
+
+        def explain(query, params=(), **kwargs):
+            execute(self.backend.explain_prefix + query, params)
+            plans.append(self.backend.describe_plan(self.cursor.fetchall()))
+
+        self.execute = explain
+        try:
+            yield plans
+        finally:
+            self.execute = execute
+
+    def get_applied_migrations(self):
+        query = 'CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, '
+        query += 'applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+        self.execute(query)
+        self.execute('SELECT version FROM schema_migrations')
+        return {row['version'] for row in self.cursor.fetchall()}
+
+    def record_migration(self, version, name):
+        query = 'INSERT INTO schema_migrations (version, name) VALUES (%s, %s)'
+        params = (version, name)
         self.execute(query, params)
-        tables = self.cursor.fetchall()
+        self.commit()
+
+    def get_schema(self):
+        return self.backend.get_schema(self)
+
+    def check_schema(self, expected_schema):
+        actual_schema = self.get_schema()
+        problems = []
 
-        # if len(tables) != 9:
-        #     with current_app.open_resource('schema.sql') as f:
-        #         self.executescript(f.read().decode('utf8'))
+        for table_name, expected in expected_schema.items():
+            actual = actual_schema.get(table_name)
+
+            if actual is None:
+                problems.append(f'Missing table: {table_name}')
+                continue
+
+            for column in expected['columns']:
+                if column not in actual['columns']:
+                    problems.append(f'Missing column: {table_name}.{column}')
+
+            actual_indexes = [tuple(columns) for columns in actual['indexes'].values()]
+            for index_name, columns in expected['indexes'].items():
+                if tuple(columns) not in actual_indexes:
+                    problems.append(f'Missing index: {table_name}.{index_name} ({", ".join(columns)})')
+
+        return problems
 
     def make_admin(self, uid, admin_level=0):
         levels = {0: 'no', 1: 'read', 2: 'read-write'}
@@ -63,14 +274,47 @@ class Database:
         params = (levels[admin_level], uid)
         self.execute(query, params)
         self.commit()
+        user_cache.invalidate(uid)
 
-    def get_users(self, columns=('*',)):
+    def get_users(self, columns=USER_COLUMNS):
         user_columns = ', '.join(['users.' + column for column in columns])
         query = 'SELECT ' + user_columns + ', age_group_id FROM users LEFT JOIN memberships ON membership_id=memberships.id'
         self.execute(query)
         users = self.cursor.fetchall()
         return users
 
+    def get_users_page(self, columns=USER_COLUMNS, sort='last_name', descending=False, cursor=None, backwards=False, limit=50):
+        sort_columns = USER_SORT_COLUMNS[sort]
+        query = 'SELECT ' + ', '.join(['users.' + column for column in columns] + select_sort_columns(sort_columns)) + ' FROM users'
+        params = []
+        values = decode_cursor(cursor, len(sort_columns))
+
+        if values:
+            condition, params = seek_condition(sort_columns, values, descending != backwards)
+            query += ' WHERE ' + condition
+
+        return self.get_page(query, params, sort_columns, descending, backwards, limit, bool(values))
+
+    def get_page(self, query, params, sort_columns, descending=False, backwards=False, limit=50, after_cursor=False):
+        # Fetch one row beyond the page to learn whether there is another page in the direction of travel
+        reverse = descending != backwards
+        query += ' ORDER BY ' + ', '.join([column + (' DESC' if reverse else '') for column in sort_columns]) + ' LIMIT %s'
+        self.execute(query, (*params, limit + 1))
+        rows = self.cursor.fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        if backwards:
+            rows.reverse()
+
+        cursors = [encode_cursor([row.pop(f'sort_{n}') for n in range(len(sort_columns))]) for row in rows]
+
+        if not rows:
+            return rows, None, None
+        if backwards:
+            return rows, cursors[-1], cursors[0] if more else None
+        return rows, cursors[-1] if more else None, cursors[0] if after_cursor else None
+
     def get_user(self, uid=None, email=None, columns=('*',)):
         user_columns = ', '.join(['users.' + column for column in columns])
         query = 'SELECT ' + user_columns + ', age_group_id FROM users LEFT JOIN memberships ON membership_id=memberships.id WHERE '
@@ -93,6 +337,25 @@ class Database:
         self.execute(query, params)
         return self.cursor.fetchone()
 
+    def get_session_user(self, uid):
+        # The role is read on every request: user_cache is only invalidated in the worker that made an edit, and a demoted
+        # or deleted admin must lose access in all of them at once
+        self.execute('SELECT admin FROM users WHERE id = %s', (uid,))
+        role = self.cursor.fetchone()
+
+        if role is None:
+            user_cache.invalidate(uid)
+            return None
+
+        user = user_cache.get(uid)
+
+        if user is None:
+            user = self.get_user(uid=uid, columns=SESSION_USER_COLUMNS)
+            if user:
+                user_cache.set(uid, user)
+
+        return dict(user, admin=role['admin']) if user else user
+
     def add_user(self, email, password, first_name, last_name, mobile_number, membership_id, admin_level='no'):
         query = 'INSERT INTO users (email, password, first_name, last_name, mobile_number, membership_id, admin)'
         query += ' VALUES (%s, %s, %s, %s, %s, %s, %s)'
@@ -105,6 +368,10 @@ class Database:
         params = (value, uid)
         self.execute(query, params)
         self.commit()
+        user_cache.invalidate(uid)
+
+        if column in ('is_coach', 'first_name', 'last_name', 'email'):
+            reference_cache.clear()
 
     def change_password(self, uid, new_password):
         column = 'password'
@@ -117,14 +384,56 @@ class Database:
         self.execute(query, params)
         self.commit()
 
+    def update_user_access_times(self, access_times):
+        if not access_times:
+            return
+
+        cases = ' '.join(['WHEN %s THEN %s'] * len(access_times))
+        placeholders = ', '.join(['%s'] * len(access_times))
+        query = f'UPDATE users SET last_access = CASE id {cases} END WHERE id IN ({placeholders})'
+        params = [value for item in access_times.items() for value in item] + list(access_times.keys())
+        self.execute(query, params)
+        # Committed on the raw connection: the batch is nobody's own write, so it must not pin the session to the primary
+        self.db.commit()
+
     def delete_user(self, uid):
         query = 'DELETE FROM users WHERE id = %s'
         params = (uid,)
         self.execute(query, params)
         self.commit()
+        user_cache.invalidate(uid)
+        reference_cache.clear()
+
+    def get_reference_data(self, key, load):
+        data = reference_cache.get(key)
+
+        if data is None:
+            data = load()
+            reference_cache.set(key, data)
+
+        return data
 
     def get_coaches(self):
-        query = 'SELECT id, email, first_name, last_name FROM users WHERE is_coach=true'
+        return self.get_reference_data('coaches', self.load_coaches)
+
+    def load_coaches(self):
+        query = 'SELECT id, email, first_name, last_name FROM users WHERE is_coach=true ORDER BY first_name, last_name'
+        self.execute(query)
+        return self.cursor.fetchall()
+
+    def get_coach_options(self):
+        # Labels and values for a select box, built once per cache lifetime rather than on every render
+        def load():
+            coaches = self.get_coaches()
+            return [f'{coach["first_name"]} {coach["last_name"]}' for coach in coaches], [coach['id'] for coach in coaches]
+
+        return self.get_reference_data('coach_options', load)
+
+    def get_age_groups(self):
+        return self.get_reference_data('age_groups', self.load_age_groups)
+
+    def load_age_groups(self):
+        query = 'SELECT id, name, min_age, max_age FROM age_groups ORDER BY min_age'
         self.execute(query)
         return self.cursor.fetchall()
 
@@ -133,114 +442,301 @@ class Database:
             flash('Invalid class type. Class type must be either Gi or No Gi')
             return False
 
-        query = 'INSERT INTO classes (class_name, class_type, weekday, time, duration, coach_id) '
-        query += 'VALUES (%s, %s, %s, %s, %s, %s)'
-        params = (class_name, class_type, weekday, time, duration, coach_id)
+        query = 'INSERT INTO classes (class_name, class_type, weekday, time, duration, end_time, coach_id) '
+        query += 'VALUES (%s, %s, %s, %s, %s, %s, %s)'
+        params = (class_name, class_type, weekday, time, duration, get_end_time(time, duration), coach_id)
         self.execute(query, params)
         self.commit()
+        timetable.invalidate()
         return True
 
     def get_classes(self, weekday=None, class_time=None, age_group=None):
-        query = 'SELECT id, DATE_FORMAT(time, "%H:%i") class_time, class_name, duration, '
-        query += 'DATE_FORMAT(ADDTIME(time, duration), "%H:%i") end_time, weekday, age_group_id'
-        query += ' FROM classes WHERE weekday = %s AND time >= %s'
-        params = []
-        today = datetime.today()
+        weekday = weekday if weekday is not None else datetime.today().weekday()
+        return timetable.get_classes(self, weekday, class_time if class_time else '00:00:00', age_group if age_group else None)
+
+    def get_checked_in_class_ids(self, user_id, day):
+        # Read from the primary: the check-in page re-renders straight after the member toggles a class
+        query = 'SELECT class_id FROM attendance WHERE user_id = %s AND date >= %s AND date < %s'
+        start_of_day = datetime.combine(get_date(day), time())
+        params = (user_id, start_of_day, start_of_day + timedelta(days=1))
+        self.execute(query, params)
+        return {row['class_id'] for row in self.cursor.fetchall()}
 
-        if weekday:
-            params.append(weekday)
-        else:
-            params.append(today.strftime('%A'))
+    def get_all_classes(self):
+        return timetable.get_all_classes(self)
 
-        if class_time:
-            show_classes_from_time = class_time
-        else:
-            show_classes_from_time = '00:00:00'
+    @replica_read
+    def load_timetable(self):
+        query = 'SELECT id, class_name, weekday, time, duration, end_time, age_group_id FROM classes ORDER BY weekday, time, class_name'
+        self.execute(query)
+        return self.cursor.fetchall()
+
+    def check_in(self, class_id, user_id, class_date, class_time):
+        self.check_in_many(user_id, [(class_id, class_date, class_time)])
+
+    def remove_check_in(self, class_id, user_id, class_date, class_time):
+        self.remove_check_ins(user_id, [(class_id, class_date, class_time)])
+
+    def check_in_many(self, user_id, classes):
+        params = [(user_id, class_id, class_date, class_time) for class_id, class_date, class_time in classes]
+        if not params:
+            return
 
-        params.append(show_classes_from_time)
+        query = 'INSERT INTO attendance (user_id, class_id, class_date, class_time) VALUES (%s, %s, %s, %s)'
+        self.executemany(query, params)
+        self.update_attendance_rollups([(user_id, class_id, class_date) for user_id, class_id, class_date, _ in params], 1)
+        self.commit()
+        invalidate_current_reports()
 
-        if age_group:
-            query += ' AND age_group_id = %s'
-            params.append(age_group)
+    def remove_check_ins(self, user_id, classes):
+        classes = list(classes)
+        if not classes:
+            return
 
+        conditions = ' OR '.join(['(class_id = %s AND class_date = %s AND class_time = %s)'] * len(classes))
+        query = f'SELECT id, user_id, class_id, class_date FROM attendance WHERE user_id = %s AND ({conditions}) FOR UPDATE'
+        params = [user_id] + [value for attended_class in classes for value in attended_class]
         self.execute(query, params)
-        todays_classes = self.cursor.fetchall()
-        return todays_classes
+        removed = self.cursor.fetchall()
 
-    def get_all_classes(self):
-        query = 'SELECT id class_id, DATE_FORMAT(time, "%H:%i") class_time, class_name, duration, '
-        query += 'DATE_FORMAT(ADDTIME(time, duration), "%H:%i") end_time, weekday'
-        query += ' FROM classes'
+        if removed:
+            query = 'DELETE FROM attendance WHERE id IN (' + ', '.join(['%s'] * len(removed)) + ')'
+            self.execute(query, [row['id'] for row in removed])
+            self.update_attendance_rollups([(row['user_id'], row['class_id'], row['class_date']) for row in removed], -1)
+
+        self.commit()
+        invalidate_current_reports()
+
+    def update_attendance_rollups(self, attendances, change):
+        # Callers commit, so the rollups change in the same transaction as the attendance rows
+        class_counts = Counter((class_id, class_date) for user_id, class_id, class_date in attendances)
+        week_counts = Counter((user_id, get_week_start(class_date)) for user_id, class_id, class_date in attendances)
+
+        query = 'INSERT INTO class_attendance_daily (class_id, class_date, attendees) VALUES (%s, %s, %s) '
+        query += 'ON DUPLICATE KEY UPDATE attendees = attendees + VALUES(attendees)'
+        self.executemany(query, [(class_id, class_date, change * count) for (class_id, class_date), count in class_counts.items()])
+
+        query = 'INSERT INTO user_attendance_weekly (user_id, week_start, attendances) VALUES (%s, %s, %s) '
+        query += 'ON DUPLICATE KEY UPDATE attendances = attendances + VALUES(attendances)'
+        self.executemany(query, [(user_id, week_start, change * count) for (user_id, week_start), count in week_counts.items()])
+
+    def rebuild_attendance_rollups(self):
+        self.execute('DELETE FROM class_attendance_daily')
+        # The rollups cover archived attendance too
+        source = '(SELECT user_id, class_id, class_date FROM attendance UNION ALL '
+        source += 'SELECT user_id, class_id, class_date FROM attendance_archive) attendance'
+        query = 'INSERT INTO class_attendance_daily (class_id, class_date, attendees) '
+        query += f'SELECT class_id, class_date, COUNT(*) FROM {source} GROUP BY class_id, class_date'
         self.execute(query)
-        return self.cursor.fetchall()
 
+        self.execute('DELETE FROM user_attendance_weekly')
+        query = 'INSERT INTO user_attendance_weekly (user_id, week_start, attendances) '
+        query += f'SELECT user_id, DATE_SUB(class_date, INTERVAL WEEKDAY(class_date) DAY) week_start, COUNT(*) FROM {source} '
+        query += 'GROUP BY user_id, week_start'
+        self.execute(query)
+        self.commit()
 
-    def check_in(self, class_id, user_id, class_date, class_time):
-        query = 'INSERT INTO attendance (user_id, class_id, class_date, class_time) VALUES (%s, %s, %s, %s);'
-        params = (user_id, class_id, class_date, class_time)
+    @replica_read
+    def get_class_headcounts(self, class_date):
+        query = 'SELECT classes.class_name, COALESCE(daily.attendees, 0) attendees FROM classes '
+        query += 'LEFT JOIN class_attendance_daily daily ON daily.class_id = classes.id AND daily.class_date = %s '
+        query += 'WHERE classes.weekday = %s ORDER BY classes.time, classes.class_name'
+        params = (class_date.date(), class_date.weekday())
         self.execute(query, params)
-        self.commit()
+        return self.cursor.fetchall()
 
-    def remove_check_in(self, class_id, user_id, class_date, class_time):
-        query = 'DELETE FROM attendance WHERE class_id = %s AND user_id = %s AND class_date = %s AND class_time = %s'
-        params = (class_id, user_id, class_date, class_time)
+    @replica_read
+    def get_average_weekly_attendance(self, weeks=12):
+        # Average over the last complete weeks so the current, partial week does not drag it down
+        to_date = get_week_start(datetime.today())
+        from_date = to_date - timedelta(weeks=weeks)
+        query = 'SELECT classes.id class_id, ROUND(COALESCE(SUM(daily.attendees), 0) / %s, 2) avg_weekly_attendance '
+        query += 'FROM classes LEFT JOIN class_attendance_daily daily ON daily.class_id = classes.id '
+        query += 'AND daily.class_date >= %s AND daily.class_date < %s GROUP BY classes.id'
+        # A float divisor keeps SQLite from truncating the average to an integer
+        params = (float(weeks), from_date, to_date)
         self.execute(query, params)
-        self.commit()
+        return self.cursor.fetchall()
+
+    @replica_read
+    def get_user_class_attendances(self, user_id):
+        source, params = self.get_attendance_source(user_id=user_id)
+        query = f'SELECT class_id, COUNT(*) attendances FROM {source} WHERE user_id = %s GROUP BY class_id'
+        self.execute(query, (*params, user_id))
+        return {row['class_id']: row['attendances'] for row in self.cursor.fetchall()}
+
+    @replica_read
+    def get_weekly_user_attendance(self, from_date, to_date):
+        query = 'SELECT weekly.user_id, CONCAT(users.first_name, " ", users.last_name) AS full_name, weekly.week_start, '
+        query += 'weekly.attendances, memberships.sessions_per_week FROM user_attendance_weekly weekly '
+        query += 'INNER JOIN users ON weekly.user_id = users.id INNER JOIN memberships ON memberships.id = users.membership_id '
+        query += 'WHERE weekly.week_start >= %s AND weekly.week_start <= %s AND weekly.attendances > 0'
+        params = (get_week_start(from_date), to_date)
+        self.execute(query, params)
+        return self.cursor.fetchall()
 
-    def get_attendance(self, from_date='', to_date='', user_id=None, class_id=None, 
-                       columns=('classes.class_name', 'class_date', 'DATE_FORMAT(class_time, "%H:%i") class_time', 'class_id', 'user_id',
-                                'CONCAT(users.first_name, " ", users.last_name) AS full_name', 'membership_type', 'date AS check_in_time'),
+    @replica_read
+    def get_attendance(self, from_date='', to_date='', user_id=None, class_id=None, columns=ATTENDANCE_COLUMNS.values(),
                        extra_columns=None):
+        query, params = self.build_attendance_query(from_date, to_date, user_id, class_id, columns, extra_columns)
+        self.execute(query, params)
+        return self.cursor.fetchall()
+
+    @replica_read
+    def get_attendance_page(self, from_date='', to_date='', columns=ATTENDANCE_COLUMNS.values(), sort='class', descending=False,
+                            cursor=None, backwards=False, limit=50):
+        sort_columns = ATTENDANCE_SORT_COLUMNS[sort]
+        values = decode_cursor(cursor, len(sort_columns))
+        condition, params = seek_condition(sort_columns, values, descending != backwards) if values else ('', [])
+
+        if sort == 'class' and from_date and to_date:
+            # Members check in on the day of the class, so bounding class_date too lets the sort index drive the range scan
+            condition = ' AND '.join(filter(None, ['attendance.class_date >= %s', 'attendance.class_date <= %s', condition]))
+            params = [get_date(from_date), get_date(to_date)] + params
+
+        query, params = self.build_attendance_query(from_date, to_date, columns=list(columns) + select_sort_columns(sort_columns),
+                                                    seek=(condition, params) if condition else None)
+        return self.get_page(query, params, sort_columns, descending, backwards, limit, bool(values))
+
+    def iter_attendance(self, from_date='', to_date='', columns=ATTENDANCE_COLUMNS.keys(), chunk_size=1000):
+        # Streams rows from an unbuffered cursor; the first item is the tuple of column names
+        query, params = self.build_attendance_query(from_date, to_date, columns=[ATTENDANCE_COLUMNS[column] for column in columns])
+        query += ' ORDER BY class_date, class_time, classes.class_name, attendance.date'
+        return self.stream_query(query, params, chunk_size)
+
+    def stream_query(self, query, params, chunk_size=1000):
+        # stream_with_context keeps the request, and so this connection, open until the last row is sent
+        connection = self.read_connection()
+        cursor = connection.cursor()
+        # Time spent waiting on the database only, not on the client reading the response
+        seconds = 0.0
+        row_count = 0
+
+        try:
+            start = perf_counter()
+            cursor.execute(query, params)
+            seconds += perf_counter() - start
+            yield tuple(cursor.column_names)
+
+            while True:
+                start = perf_counter()
+                rows = cursor.fetchmany(chunk_size)
+                seconds += perf_counter() - start
+
+                if not rows:
+                    break
+                row_count += len(rows)
+                yield from rows
+        finally:
+            connection.consume_results()
+            cursor.close()
+            self.record_statement(query, params, seconds, row_count)
+
+    def build_attendance_query(self, from_date='', to_date='', user_id=None, class_id=None, columns=ATTENDANCE_COLUMNS.values(),
+                               extra_columns=None, seek=None):
         query_columns = ', '.join(columns)
         if extra_columns:
             query_columns += ', ' + ', '.join(extra_columns)
-        query = f'SELECT {query_columns}  FROM attendance '
+        source, params = self.get_attendance_source(from_date, to_date, user_id, class_id)
+        query = f'SELECT {query_columns}  FROM {source} '
         query += 'INNER JOIN classes ON attendance.class_id=classes.id INNER JOIN users ON attendance.user_id=users.id ' 
         query += 'INNER JOIN memberships ON memberships.id=users.membership_id'
         where_clause = ' WHERE '
-        conditions = []
-        params = []
+        conditions, condition_params = get_attendance_conditions(from_date, to_date, user_id, class_id)
+        params += condition_params
 
-        if from_date:
-            conditions.append('date >= %s')
-            params.append(from_date)
-        if to_date:
-            conditions.append('date <= %s')
-            params.append(to_date)
-
-        if user_id:
-            conditions.append('user_id = %s')
-            params.append(user_id)
-        if class_id:
-            conditions.append('class_id = %s')
-            params.append(class_id)
+        if seek:
+            conditions.append(seek[0])
+            params.extend(seek[1])
 
         where_clause += ' AND '.join(conditions)
         if conditions:
             query += where_clause
-        self.execute(query, params)
-        return self.cursor.fetchall()
+        return query, params
+
+    def get_attendance_source(self, from_date='', to_date='', user_id=None, class_id=None):
+        # Archived years are only read when the range reaches back into them; each branch of the union filters on its own indexes
+        archive_end = self.get_archive_end()
+
+        if archive_end is None or (from_date and get_datetime(from_date) > archive_end):
+            return 'attendance', []
+
+        conditions, params = get_attendance_conditions(from_date, to_date, user_id, class_id)
+        where_clause = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        source = f'(SELECT * FROM attendance{where_clause} UNION ALL SELECT * FROM attendance_archive{where_clause}) attendance'
+        return source, params * 2
+
+    def get_archive_end(self):
+        archive_end = archive_cache.get('archive_end')
+
+        if archive_end is None:
+            self.execute('SELECT MAX(date) archive_end FROM attendance_archive')
+            archive_end = get_datetime(self.cursor.fetchone()['archive_end'])
+
+            # An empty archive is looked up again each time, so the first archiving run is seen straight away
+            if archive_end is not None:
+                archive_cache.set('archive_end', archive_end)
+
+        return archive_end
+
+    def archive_attendance(self, before):
+        # Moves a month at a time to keep each transaction small; the rollups already count both tables, so they are left alone
+        self.execute('SELECT MIN(date) first_date FROM attendance WHERE date < %s', (before,))
+        first_date = get_datetime(self.cursor.fetchone()['first_date'])
+        start = datetime(first_date.year, first_date.month, 1) if first_date else before
+        moved = 0
+
+        while start < before:
+            end = min(datetime(start.year + start.month // 12, start.month % 12 + 1, 1), before)
+            params = (start, end)
+            self.execute('INSERT INTO attendance_archive SELECT * FROM attendance WHERE date >= %s AND date < %s', params)
+            moved += self.cursor.rowcount
+            self.execute('DELETE FROM attendance WHERE date >= %s AND date < %s', params)
+            self.commit()
+            start = end
 
+        archive_cache.clear()
+        return moved
+
+    @replica_read
     def get_absentees(self, from_date=''):
         if not from_date:
             from_date = datetime.today() - timedelta(days=14)
 
-        query = 'SELECT CONCAT(users.first_name, " ", users.last_name) AS full_name, users.email, users.mobile_number, a1.date last_class '
-        query += 'FROM attendance a1 RIGHT JOIN users ON a1.user_id=users.id WHERE users.is_coach = false AND'
-        query += '((a1.date = (SELECT MAX(a2.date) FROM attendance a2 WHERE a2.user_id=a1.user_id) AND a1.date <= %s) OR a1.date IS NULL)'
+        # Each grouped branch is a loose scan of its table's (user_id, date) index, so it costs one lookup per member per table.
+        # Archived years count too, or members who last trained before the archive boundary would show as never attending
+        tiers = '(SELECT user_id, MAX(date) last_class FROM attendance GROUP BY user_id UNION ALL '
+        tiers += 'SELECT user_id, MAX(date) last_class FROM attendance_archive GROUP BY user_id) tiers'
+        query = 'SELECT CONCAT(users.first_name, " ", users.last_name) AS full_name, users.email, users.mobile_number, '
+        query += 'last_attended.last_class FROM users LEFT JOIN '
+        query += f'(SELECT user_id, MAX(last_class) last_class FROM {tiers} GROUP BY user_id) last_attended ON last_attended.user_id=users.id '
+        query += 'WHERE users.is_coach = false AND (last_attended.last_class <= %s OR last_attended.last_class IS NULL)'
         params = (from_date.date(),)
         self.execute(query, params)
         return self.cursor.fetchall()
 
     def get_membership_types(self):
+        return self.get_reference_data('membership_types', self.load_membership_types)
+
+    def load_membership_types(self):
         query = 'SELECT memberships.id, membership_type, age_groups.name FROM memberships JOIN age_groups ON age_group_id=age_groups.id'
         self.execute(query)
         return self.cursor.fetchall()
 
+    def get_membership_options(self):
+        def load():
+            memberships = self.get_membership_types()
+            labels = [f'{membership["name"].capitalize()} - {membership["membership_type"].capitalize()}' for membership in memberships]
+            return labels, [membership['id'] for membership in memberships]
+
+        return self.get_reference_data('membership_options', load)
+
     def update_unlimited_class_count(self):
         query = 'UPDATE memberships SET sessions_per_week = (SELECT COUNT(id) FROM classes) WHERE membership_type = "unlimited"'
         self.execute(query)
-        return self.commit()
+        self.commit()
+        timetable.invalidate()
+        reference_cache.clear()
 
     def add_password_reset(self, uid, token):
         query = 'INSERT INTO password_resets (user_id, token, valid_until) VALUES (%s, %s, %s)'
@@ -267,9 +763,459 @@ class Database:
         self.commit()
 
 
-class QueryResult(DataFrame):
-    def __bool__(self):
-        return not self.empty
+class AccessTimeBuffer:
+    def __init__(self, flush_interval=60, batch_size=100, coalesce_window=60):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.coalesce_window = coalesce_window
+        self.pending = {}
+        self.last_recorded = {}
+        self.last_flush = monotonic()
+        self.pid = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def record(self, uid):
+        now = monotonic()
+
+        with self._lock:
+            last_recorded = self.last_recorded.get(uid)
+            if last_recorded is not None and now - last_recorded < self.coalesce_window:
+                return
+
+            self.last_recorded[uid] = now
+            self.pending[uid] = datetime.now().replace(microsecond=0)
+
+    def flush_due(self):
+        if not self.pending:
+            return False
+        return len(self.pending) >= self.batch_size or monotonic() - self.last_flush >= self.flush_interval
+
+    def flush(self, db):
+        now = monotonic()
+
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = now
+            self.last_recorded = {uid: recorded for uid, recorded in self.last_recorded.items()
+                                  if now - recorded < self.coalesce_window}
+
+        try:
+            db.update_user_access_times(pending)
+        except Exception:
+            # Keep the stamps for the next flush rather than losing them
+            with self._lock:
+                self.pending = {**pending, **self.pending}
+            raise
+
+        return len(pending)
+
+    def start_timer(self, flush):
+        # A worker that stops getting requests never reaches the flush in before_app_request, so each worker process
+        # also flushes on a timer of its own; threads do not survive a fork, hence the pid check
+        with self._lock:
+            if self._timer is None or self.pid != os.getpid() or not self._timer.is_alive():
+                self.pid = os.getpid()
+                self._timer = threading.Thread(target=self._run, args=(flush,), name='access-time-flush', daemon=True)
+                self._timer.start()
+
+    def _run(self, flush):
+        while True:
+            sleep(max(self.last_flush + self.flush_interval - monotonic(), 1))
+
+            if self.flush_due():
+                try:
+                    flush()
+                except Exception as e:
+                    logger.warning(f'Could not flush access times: {e}')
+
+
+class Timetable:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.loads = 0
+        self._lock = threading.Lock()
+        self._classes = None
+        self._index = {}
+        self._expires = 0
+
+    def get_classes(self, db, weekday, class_time='00:00:00', age_group=None):
+        # Each day's classes are sorted by start time, so those starting at or after class_time are a suffix of the list
+        classes, index = self._load(db)
+        starts, classes = index.get((weekday, age_group), ((), ()))
+        first = bisect_left(starts, get_seconds(class_time))
+        return [dict(cls) for cls in classes[first:]]
+
+    def get_all_classes(self, db):
+        columns = ('class_time', 'class_name', 'duration', 'end_time', 'weekday')
+        classes, index = self._load(db)
+        return [dict({'class_id': cls['id']}, **{column: cls[column] for column in columns}) for cls in classes]
+
+    def _load(self, db):
+        with self._lock:
+            if self._classes is not None and monotonic() < self._expires:
+                return self._classes, self._index
+
+        classes = []
+        for row in db.load_timetable():
+            start = row['time']
+            classes.append({
+                'id': row['id'],
+                'class_time': format_hours_and_minutes(start),
+                'class_name': row['class_name'],
+                'duration': row['duration'],
+                'end_time': format_hours_and_minutes(row['end_time']),
+                'weekday': row['weekday'],
+                'age_group_id': row['age_group_id'],
+                'start_seconds': int(start.total_seconds())
+            })
+
+        index = {}
+        for cls in classes:
+            # Each class is listed under its age group and under None, for lookups across all age groups
+            for key in ((cls['weekday'], cls['age_group_id']), (cls['weekday'], None)):
+                starts, entries = index.setdefault(key, ([], []))
+                starts.append(cls['start_seconds'])
+                entries.append({column: value for column, value in cls.items() if column != 'start_seconds'})
+
+        with self._lock:
+            self._classes = classes
+            self._index = index
+            self._expires = monotonic() + self.ttl
+            self.loads += 1
+            return classes, index
+
+    def invalidate(self):
+        # Other worker processes pick up the change when their copy expires after ttl seconds
+        with self._lock:
+            self._classes = None
+            self._index = {}
+
+    def stats(self):
+        return {
+            'classes': len(self._classes) if self._classes is not None else 0,
+            'loads': self.loads,
+            'ttl_seconds': self.ttl
+        }
+
+
+def get_seconds(class_time) -> int:
+    if isinstance(class_time, timedelta):
+        return int(class_time.total_seconds())
+    if isinstance(class_time, str):
+        hours, minutes, *seconds = class_time.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + int(float(seconds[0]) if seconds else 0)
+    return class_time.hour * 3600 + class_time.minute * 60 + class_time.second
+
+
+def get_end_time(start, duration='1:00:00') -> timedelta:
+    return timedelta(seconds=get_seconds(start) + get_seconds(duration))
+
+
+def format_hours_and_minutes(duration: timedelta) -> str:
+    minutes = int(duration.total_seconds()) // 60
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def parse_schema(script):
+    schema = {}
+    script = re.sub(r'--[^\n]*', '', script)
+
+    for statement in script.split(';'):
+        statement = ' '.join(statement.split())
+        create_table = re.match(r'CREATE TABLE (?:IF NOT EXISTS )?`?(\w+)`? \((.*)\)', statement, re.IGNORECASE)
+        create_index = re.match(r'CREATE (?:UNIQUE )?INDEX `?(\w+)`? ON `?(\w+)`? \((.*)\)', statement, re.IGNORECASE)
+
+        if create_table:
+            table_name, body = create_table.groups()
+            table = schema.setdefault(table_name, {'columns': [], 'indexes': {}})
+
+            for definition in split_definitions(body):
+                keyword = definition.split()[0].upper()
+
+                if keyword in ('FOREIGN', 'CONSTRAINT', 'CHECK'):
+                    continue
+                elif keyword == 'PRIMARY':
+                    table['indexes']['PRIMARY'] = index_columns(definition)
+                elif keyword in ('UNIQUE', 'KEY', 'INDEX'):
+                    name = re.match(r'(?:UNIQUE )?(?:KEY |INDEX )?`?(\w+)`? ?\(', definition, re.IGNORECASE)
+                    columns = index_columns(definition)
+                    unnamed = not name or name.group(1).upper() in ('UNIQUE', 'KEY', 'INDEX')
+                    table['indexes'][columns[0] if unnamed else name.group(1)] = columns
+                else:
+                    column = definition.split()[0].strip('`')
+                    table['columns'].append(column)
+
+                    if 'PRIMARY KEY' in definition.upper():
+                        table['indexes']['PRIMARY'] = [column]
+        elif create_index:
+            index_name, table_name, columns = create_index.groups()
+            table = schema.setdefault(table_name, {'columns': [], 'indexes': {}})
+            table['indexes'][index_name] = index_columns(f'({columns})')
+
+    return schema
+
+
+def split_definitions(body):
+    definitions = []
+    depth = 0
+    current = ''
+
+    for character in body:
+        if character == ',' and depth == 0:
+            definitions.append(current.strip())
+            current = ''
+            continue
+        if character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        current += character
+
+    if current.strip():
+        definitions.append(current.strip())
+
+    return definitions
+
+
+def index_columns(definition):
+    columns = definition[definition.index('(') + 1:definition.rindex(')')]
+    # Drop prefix lengths, e.g. email(255)
+    columns = re.sub(r'\(\d+\)', '', columns)
+    return [column.strip().strip('`').split()[0] for column in columns.split(',')]
+
+
+class ConnectionPool:
+    """Process-wide pool of MySQL connections shared by every request served by a worker."""
+
+    def __init__(self, size=5, timeout=5, reset_session=True, backend=None, **connect_args):
+        self.backend = backend if backend else MySQLBackend()
+        self.size = size
+        self.timeout = timeout
+        self.reset_session = reset_session
+        self.connect_args = connect_args
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def get_connection(self):
+        start = perf_counter()
+        connection = self._checkout()
+        wait = perf_counter() - start
+
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        return connection
+
+    def _checkout(self):
+        deadline = perf_counter() + self.timeout
+
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve():
+                    return self._connect()
+
+                try:
+                    connection = self._idle.get(timeout=max(deadline - perf_counter(), 0))
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise PoolError(f'No database connection became available within {self.timeout} seconds '
+                                    f'(pool size {self.size}).')
+
+            if self._is_healthy(connection):
+                return connection
+
+    def _reserve(self):
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return True
+        return False
+
+    def _connect(self):
+        try:
+            return self.backend.connect(**self.connect_args)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _is_healthy(self, connection):
+        if connection.is_connected():
+            return True
+
+        with self._lock:
+            self.reconnects += 1
+
+        try:
+            connection.reconnect(attempts=1)
+            return True
+        except Exception:
+            self._discard(connection)
+            return False
+
+    def release(self, connection):
+        with self._lock:
+            self.in_use -= 1
+
+        try:
+            connection.rollback()
+            if self.reset_session:
+                connection.reset_session()
+        except Exception:
+            self._discard(connection)
+            return
+
+        self._idle.put(connection)
+
+    def _discard(self, connection):
+        with self._lock:
+            self._created -= 1
+
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        return {
+            'pid': self.pid,
+            'size': self.size,
+            'open': self._created,
+            'in_use': self.in_use,
+            'idle': self._idle.qsize(),
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'reconnects': self.reconnects,
+            'average_wait_ms': round(1000 * self.total_wait / self.checkouts, 3) if self.checkouts else 0.0,
+            'max_wait_ms': round(1000 * self.max_wait, 3)
+        }
+
+
+class ReplicaPool(ConnectionPool):
+    def __init__(self, max_lag=5, check_interval=10, **kwargs):
+        super().__init__(**kwargs)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self.lag_checks = 0
+        self.fallbacks = 0
+        self._next_check = 0
+
+    def available(self):
+        # Between checks, a replica last seen lagging or unreachable is not worth a connection
+        if monotonic() < self._next_check and not self._lag_acceptable():
+            with self._lock:
+                self.fallbacks += 1
+            return False
+        return True
+
+    def is_current(self, connection):
+        with self._lock:
+            due = monotonic() >= self._next_check
+            if due:
+                self._next_check = monotonic() + self.check_interval
+
+        if due:
+            try:
+                self.lag = self.backend.replica_lag(connection)
+            except Exception as e:
+                logger.warning(f'Could not read replica lag: {e}')
+                self.lag = None
+            self.lag_checks += 1
+
+        if self._lag_acceptable():
+            return True
+
+        with self._lock:
+            self.fallbacks += 1
+        return False
+
+    def mark_unavailable(self):
+        with self._lock:
+            self.lag = None
+            self.fallbacks += 1
+            self._next_check = monotonic() + self.check_interval
+
+    def _lag_acceptable(self):
+        return self.lag is not None and self.lag <= self.max_lag
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'lag_seconds': self.lag,
+            'max_lag_seconds': self.max_lag,
+            'lag_checks': self.lag_checks,
+            'primary_fallbacks': self.fallbacks
+        })
+        return stats
+
+
+def QueryResult(*args, **kwargs):
+    # The DataFrame subclass lives in nexusbjj.frames so that pandas is only imported once a view builds a result
+    from nexusbjj.frames import QueryResult
+    return QueryResult(*args, **kwargs)
+
+
+def invalidate_current_reports():
+    # Report cache keys are (report, start, end, columns); check-ins only change ranges reaching today. Edits made
+    # elsewhere, by other workers or by archiving, are left to the cache's TTL
+    start_of_today = datetime.combine(date.today(), time.min)
+    report_cache.invalidate_where(lambda key: key[2] >= start_of_today)
+
+
+def get_week_start(day) -> date:
+    day = get_date(day)
+    return day - timedelta(days=day.weekday())
+
+
+def get_date(day) -> date:
+    if isinstance(day, str):
+        return date.fromisoformat(day[:10])
+    return day.date() if isinstance(day, datetime) else day
+
+
+def get_datetime(day):
+    if isinstance(day, str):
+        return datetime.fromisoformat(day)
+    if isinstance(day, date) and not isinstance(day, datetime):
+        return datetime.combine(day, time.min)
+    return day
+
+
+def get_attendance_conditions(from_date='', to_date='', user_id=None, class_id=None):
+    conditions = []
+    params = []
+
+    if from_date:
+        conditions.append('date >= %s')
+        params.append(from_date)
+    if to_date:
+        conditions.append('date <= %s')
+        params.append(to_date)
+
+    if user_id:
+        conditions.append('user_id = %s')
+        params.append(user_id)
+    if class_id:
+        conditions.append('class_id = %s')
+        params.append(class_id)
+
+    return conditions, params
 
 
 def get_end_of_day(day: datetime) -> datetime:
@@ -286,6 +1232,50 @@ def order_query(params, order, descending):
     return q
 
 
+def select_sort_columns(sort_columns):
+    return [f'{column} AS sort_{n}' for n, column in enumerate(sort_columns)]
+
+
+def seek_condition(sort_columns, values, descending=False):
+    # Expands (a, b, id) > (x, y, z) so that MySQL can turn it into a range scan on the sort index
+    operator = '<' if descending else '>'
+    conditions = []
+    params = []
+
+    for n, column in enumerate(sort_columns):
+        terms = [f'{previous} = %s' for previous in sort_columns[:n]] + [f'{column} {operator} %s']
+        conditions.append('(' + ' AND '.join(terms) + ')')
+        params.extend(values[:n + 1])
+
+    return '(' + ' OR '.join(conditions) + ')', params
+
+
+def encode_cursor(values):
+    values = [format_cursor_value(value) for value in values]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, length):
+    if not cursor:
+        return None
+
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+
+    return values if isinstance(values, list) and len(values) == length else None
+
+
+def format_cursor_value(value):
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+    if isinstance(value, (date, datetime)):
+        return value.isoformat(' ') if isinstance(value, datetime) else value.isoformat()
+    return value
+
+
 def select(columns, table):
     return 'SELECT ' + ', '.join(columns) + ' FROM ' + table
 
@@ -328,27 +1318,281 @@ def make_folder(path):
     return path
 
 
+_pool = None
+_replica_pool = None
+_schema_problems = None
+access_times = AccessTimeBuffer()
+user_cache = TTLCache(maxsize=256, ttl=60)
+report_cache = TTLCache(maxsize=64, ttl=60)
+# Membership types, age groups and coaches: small, rarely edited and needed to render most forms
+reference_cache = TTLCache(maxsize=16, ttl=300)
+# The newest archived check-in, which decides whether a report range needs the archive at all
+archive_cache = TTLCache(maxsize=1, ttl=300)
+timetable = Timetable()
+
+
+def get_pool_size(config):
+    # At least two, so that the access-time timer can write while a request holds a connection
+    if config.get('DATABASE_POOL_SIZE'):
+        return max(2, int(config['DATABASE_POOL_SIZE']))
+
+    # Split the server's connection budget across the uWSGI workers of this host
+    max_connections = config.get('DATABASE_MAX_CONNECTIONS')
+    if max_connections:
+        try:
+            import uwsgi
+            workers = uwsgi.numproc
+        except ImportError:
+            workers = config.get('WORKERS', 1)
+        return max(2, int(max_connections) // int(workers))
+
+    return 5
+
+
+def get_pool():
+    global _pool
+
+    # uWSGI forks workers after the app is loaded, so each worker must build its own pool
+    if _pool is None or _pool.pid != os.getpid():
+        config = current_app.config
+        backend = get_backend(config.get('DATABASE_BACKEND', 'mysql'))
+
+        _pool = ConnectionPool(
+            size=get_pool_size(config),
+            timeout=config.get('DATABASE_POOL_TIMEOUT', 5),
+            reset_session=config.get('DATABASE_POOL_RESET_SESSION', True),
+            backend=backend,
+            **get_connect_args(config, backend)
+        )
+
+    return _pool
+
+
+def get_replica_pool():
+    global _replica_pool
+    config = current_app.config
+
+    if not replica_configured(config):
+        return None
+
+    if _replica_pool is None or _replica_pool.pid != os.getpid():
+        backend = get_backend(config.get('DATABASE_BACKEND', 'mysql'))
+        _replica_pool = ReplicaPool(
+            max_lag=config.get('DATABASE_REPLICA_MAX_LAG', 5),
+            check_interval=config.get('DATABASE_REPLICA_LAG_CHECK_INTERVAL', 10),
+            size=get_pool_size(config),
+            timeout=config.get('DATABASE_POOL_TIMEOUT', 5),
+            reset_session=config.get('DATABASE_POOL_RESET_SESSION', True),
+            backend=backend,
+            **get_connect_args(config, backend, replica=True)
+        )
+
+    return _replica_pool
+
+
+def replica_configured(config):
+    return bool(config.get('DATABASE_REPLICA_HOST') or config.get('DATABASE_REPLICA_PATH'))
+
+
+def get_connect_args(config, backend, replica=False):
+    prefix = 'DATABASE_REPLICA_' if replica else 'DATABASE_'
+
+    if backend.name == 'sqlite':
+        return {'database': config.get(prefix + 'PATH', os.path.join(current_app.instance_path, 'nexusbjj.sqlite'))}
+
+    # The replica defaults to the primary's credentials
+    password = config.get(prefix + 'PASS', config['DATABASE_PASS'])
+    return {
+        'host': config[prefix + 'HOST'],
+        'user': config.get(prefix + 'USER', config['DATABASE_USER']),
+        'password': password if password else getpass('Enter database password: '),
+        'database': 'nexusbjj',
+        'connection_timeout': 2
+    }
+
+
 def get_db():
     if 'db' not in g:
-        g.db = Database()
+        # Only web requests read from the replica; CLI commands and sessions that wrote recently use the primary
+        replica_pool = get_replica_pool() if has_request_context() and not reading_own_writes() else None
+        g.db = Database(pool=get_pool(), replica_pool=replica_pool)
+
+        # CLI commands such as init-db and migrate-db run before the schema is in place, so only requests check it
+        if _schema_problems is None and has_request_context():
+            verify_schema(g.db)
 
     return g.db
 
 
+def get_expected_schema(db):
+    with current_app.open_resource(db.backend.schema_script) as f:
+        return parse_schema(f.read().decode('utf8'))
+
+
+def verify_schema(db):
+    # The outcome is cached for the life of the worker; use `flask check-db` to re-validate
+    global _schema_problems
+
+    _schema_problems = db.check_schema(get_expected_schema(db))
+    for problem in _schema_problems:
+        current_app.logger.warning(f'Schema check: {problem}')
+
+    return _schema_problems
+
+
+def reading_own_writes():
+    return session.get('primary_until', 0) > datetime.now().timestamp()
+
+
+def remember_writes(response):
+    # Keep a session that just wrote on the primary long enough for the replica to catch up, e.g. across a redirect
+    db = g.get('db')
+
+    if db is not None and db.wrote and replica_configured(current_app.config):
+        window = current_app.config.get('DATABASE_REPLICA_READ_YOUR_WRITES', 10)
+        session['primary_until'] = datetime.now().timestamp() + window
+
+    return response
+
+
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
         db.close()
 
 
+def flush_access_times(db=None, force=False):
+    access_times.start_timer(flush_access_times_from_pool)
+
+    if force or access_times.flush_due():
+        return access_times.flush(db if db else get_db())
+    return 0
+
+
+def write_access_times(pool):
+    db = Database(pool=pool)
+    try:
+        return access_times.flush(db)
+    finally:
+        db.close()
+
+
+@atexit.register
+def flush_access_times_from_pool():
+    # Runs outside any app context, so it can only use a pool this worker has already built
+    if access_times.pending and _pool is not None and _pool.pid == os.getpid():
+        write_access_times(_pool)
+
+
+def get_migrations():
+    folder = os.path.join(current_app.root_path, 'migrations')
+    migrations = []
+
+    for file_name in sorted(os.listdir(folder)):
+        match = re.match(r'(\d+)_(\w+)\.sql$', file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(folder, file_name)))
+
+    return migrations
+
+
+def seed_database(db, members=50, weeks=8):
+    # A small, deterministic data set for running the app locally, e.g. against the SQLite backend
+    password = generate_password_hash('password')
+    timetable = [
+        ('Fundamentals', 'Gi', 'Monday', '18:00:00'), ('Advanced', 'Gi', 'Monday', '19:00:00'),
+        ('No Gi', 'No Gi', 'Tuesday', '19:00:00'), ('Fundamentals', 'Gi', 'Wednesday', '18:00:00'),
+        ('Open Mat', 'Gi', 'Thursday', '19:00:00'), ('No Gi', 'No Gi', 'Friday', '18:30:00'),
+        ('Open Mat', 'No Gi', 'Saturday', '10:00:00'), ('Kids', 'Gi', 'Saturday', '11:30:00')
+    ]
+
+    db.executemany('INSERT INTO age_groups (name, min_age, max_age) VALUES (%s, %s, %s)', [('Adults', 16, 100), ('Kids', 4, 15)])
+    db.execute('UPDATE memberships SET age_group_id = 1')
+    db.execute('INSERT INTO users (email, password, first_name, last_name, mobile_number, membership_id, admin, is_coach) '
+               'VALUES (%s, %s, %s, %s, %s, %s, %s, true)', ('coach@example.com', password, 'Head', 'Coach', '07000000000', 4, 'read-write'))
+    coach_id = db.cursor.lastrowid
+    db.executemany('INSERT INTO users (email, password, first_name, last_name, mobile_number, membership_id, admin) '
+                   'VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                   [(f'member{n}@example.com', password, 'Member', str(n), f'07{n:09d}', n % 4 + 1, 'no') for n in range(1, members + 1)])
+    db.executemany('INSERT INTO classes (class_name, class_type, weekday, time, end_time, coach_id, age_group_id) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                   [(name, class_type, list(day_name).index(weekday), start_time, get_end_time(start_time), coach_id, 2 if name == 'Kids' else 1)
+                    for name, class_type, weekday, start_time in timetable])
+    db.commit()
+
+    db.execute('SELECT id, weekday, time FROM classes')
+    classes = db.cursor.fetchall()
+    db.execute('SELECT id FROM users WHERE is_coach = false')
+    user_ids = [row['id'] for row in db.cursor.fetchall()]
+    start = get_week_start(datetime.today()) - timedelta(weeks=weeks)
+    attendances = []
+
+    for day in (start + timedelta(days=n) for n in range(weeks * 7)):
+        for cls in (cls for cls in classes if cls['weekday'] == day.weekday()):
+            class_time = datetime.combine(day, time()) + cls['time']
+            # Every member trains on a fixed subset of the timetable so the data is the same on every run
+            attendees = [user_id for user_id in user_ids if (user_id * 7 + cls['id'] * 3 + day.toordinal()) % 5 < 2]
+            attendances.extend((user_id, class_time, cls['id'], day, cls['time']) for user_id in attendees)
+
+    db.executemany('INSERT INTO attendance (user_id, date, class_id, class_date, class_time) VALUES (%s, %s, %s, %s, %s)', attendances)
+    db.commit()
+    db.update_unlimited_class_count()
+    db.rebuild_attendance_rollups()
+
+
+def explain_queries(db):
+    today = datetime.today()
+    start_of_today = today.replace(hour=0, minute=0, second=0)
+    month_ago = today - timedelta(days=30)
+    # Looked up before explaining, so that ranges reaching into the archive are explained as the union they run as
+    archive_end = db.get_archive_end()
+    queries = {
+        'get_user (email)': lambda: db.get_user(email='explain@example.com'),
+        'validate_password_reset': lambda: db.validate_password_reset('explain'),
+        'get_attendance (date range)': lambda: db.get_attendance(from_date=month_ago, to_date=today),
+        'get_attendance (user, today)': lambda: db.get_attendance(from_date=start_of_today, to_date=today, user_id=1),
+        'get_attendance (class)': lambda: db.get_attendance(from_date=month_ago, to_date=today, class_id=1),
+        'get_absentees': lambda: db.get_absentees(),
+        'get_users_page (name)': lambda: db.get_users_page(),
+        'get_attendance_page (class)': lambda: db.get_attendance_page(month_ago, today)
+    }
+
+    if archive_end is not None:
+        archive_start = archive_end - timedelta(days=30)
+        queries['get_attendance (archived range)'] = lambda: db.get_attendance(from_date=archive_start, to_date=today)
+        queries['get_attendance_page (archived range)'] = lambda: db.get_attendance_page(archive_start, today)
+    report = []
+
+    for name, run_query in queries.items():
+        with db.explaining([]) as plans:
+            run_query()
+
+        for plan in plans:
+            for step in plan:
+                report.append({
+                    'query': name,
+                    'table': step.get('table'),
+                    'key': step.get('key'),
+                    'rows': step.get('rows'),
+                    'uses_index': step.get('key') is not None
+                })
+
+    return report
+
+
 @click.command('init-db')
 @with_appcontext
 def init_db():
     db = get_db()
 
-    with current_app.open_resource('schema.sql') as f:
+    with current_app.open_resource(db.backend.schema_script) as f:
         db.executescript(f.read().decode('utf8'))
 
+    # The schema scripts already reflect every migration
+    applied = db.get_applied_migrations()
+    for version, name, path in get_migrations():
+        if version not in applied:
+            db.record_migration(version, name)
+
     click.echo('Initialised the database.')
 
 
@@ -364,7 +1608,91 @@ def update_db(filename):
     click.echo(f'Updated the DB with script: {filename}')
 
 
+@click.command('migrate-db')
+@click.option('--explain/--no-explain', default=True, help='Report which queries use an index after migrating')
+@with_appcontext
+def migrate_db(explain):
+    db = get_db()
+    applied = db.get_applied_migrations()
+    pending = [migration for migration in get_migrations() if migration[0] not in applied]
+
+    if pending and db.backend.name != 'mysql':
+        # The migrations are MySQL scripts; other backends are created at the latest version by init-db
+        raise click.ClickException(f'Migrations can only be applied to MySQL. Run init-db to rebuild the {db.backend.name} database.')
+
+    for version, name, path in pending:
+        with open(path) as f:
+            db.executescript(f.read())
+        db.record_migration(version, name)
+        click.echo(f'Applied migration {version:04d}: {name}')
+
+    if not pending:
+        click.echo('The database is up to date.')
+
+    if explain:
+        click.echo(f'\n{"Query":<30} {"Table":<16} {"Index":<28} {"Rows":>8}')
+        for step in explain_queries(db):
+            index = step['key'] if step['uses_index'] else 'FULL SCAN'
+            click.echo(f'{step["query"]:<30} {str(step["table"]):<16} {index:<28} {str(step["rows"]):>8}')
+
+
+@click.command('rebuild-rollups')
+@with_appcontext
+def rebuild_rollups():
+    get_db().rebuild_attendance_rollups()
+    click.echo('Rebuilt the attendance rollups.')
+
+
+@click.command('archive-attendance')
+@click.option('--keep-years', default=1, help='Number of calendar years, including this one, to keep in the attendance table')
+@with_appcontext
+def archive_attendance(keep_years):
+    before = datetime(date.today().year - max(keep_years, 1) + 1, 1, 1)
+    moved = get_db().archive_attendance(before)
+    click.echo(f'Moved {moved} attendance records from before {before:%Y-%m-%d} to attendance_archive.')
+
+
+@click.command('seed-db')
+@click.option('--members', default=50, help='Number of members to create')
+@click.option('--weeks', default=8, help='Number of weeks of attendance to create')
+@with_appcontext
+def seed_db(members, weeks):
+    db = get_db()
+    seed_database(db, members, weeks)
+    click.echo(f'Seeded the database with {members} members and {weeks} weeks of attendance.')
+
+
+@click.command('check-db')
+@with_appcontext
+def check_db():
+    problems = verify_schema(get_db())
+
+    for problem in problems:
+        click.echo(problem)
+
+    if problems:
+        raise click.ClickException(f'The database does not match schema.sql ({len(problems)} problems).')
+
+    click.echo('The database matches schema.sql.')
+
+
 def init_app(app):
+    access_times.flush_interval = app.config.get('ACCESS_TIME_FLUSH_INTERVAL', 60)
+    access_times.batch_size = app.config.get('ACCESS_TIME_BATCH_SIZE', 100)
+    access_times.coalesce_window = app.config.get('ACCESS_TIME_COALESCE_WINDOW', 60)
+    user_cache.maxsize = app.config.get('USER_CACHE_SIZE', 256)
+    user_cache.ttl = app.config.get('USER_CACHE_TTL', 60)
+    report_cache.maxsize = app.config.get('REPORT_CACHE_SIZE', 64)
+    report_cache.ttl = app.config.get('REPORT_CACHE_TTL', 60)
+    reference_cache.ttl = app.config.get('REFERENCE_CACHE_TTL', 300)
+    archive_cache.ttl = app.config.get('ARCHIVE_CACHE_TTL', 300)
+    timetable.ttl = app.config.get('TIMETABLE_CACHE_TTL', 300)
+    app.after_request(remember_writes)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db)
     app.cli.add_command(update_db)
+    app.cli.add_command(migrate_db)
+    app.cli.add_command(rebuild_rollups)
+    app.cli.add_command(archive_attendance)
+    app.cli.add_command(seed_db)
+    app.cli.add_command(check_db)
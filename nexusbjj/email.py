@@ -1,5 +1,11 @@
 import smtplib
 import email
+import atexit
+import logging
+import os
+import queue
+import threading
+from time import perf_counter
 from flask import current_app
 
 
@@ -19,19 +25,191 @@ class Email:
         if debug:
             print(f'msg: {self.msg}\n\nUser: {self.user}\nPass: {self.password}\n')
 
-        
+    def queue(self):
+        # Returns immediately; the mail queue's worker thread delivers the message
+        return mail_queue.put(self.msg)
+
     def send_message(self):
-        smtp_server = 'email-smtp.eu-west-2.amazonaws.com'
-        
-        if self.debug:
-            print(f'Connecting to SMTP server: {smtp_server}')
-        session = smtplib.SMTP(smtp_server, port=587)
+        sender = SMTPSender(**dict(mail_queue.smtp_settings, user=self.user, password=self.password))
 
         if self.debug:
-            session.set_debuglevel(2)
+            print(f'Connecting to SMTP server: {sender.host}')
+            sender.debuglevel = 2
+
+        try:
+            sender.send(self.msg)
+        finally:
+            sender.close()
+
 
+class SMTPSender:
+    def __init__(self, host='email-smtp.eu-west-2.amazonaws.com', port=587, user=None, password=None, starttls=True, timeout=10):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.debuglevel = 0
+        self.session = None
+        self.connects = 0
+
+    def connect(self):
+        session = smtplib.SMTP(self.host, port=self.port, timeout=self.timeout)
+        session.set_debuglevel(self.debuglevel)
         session.ehlo()
-        session.starttls()
-        session.login(self.user, self.password)
-        session.send_message(self.msg)
-        session.quit()
\ No newline at end of file
+
+        if self.starttls:
+            session.starttls()
+            session.ehlo()
+        if self.user:
+            session.login(self.user, self.password)
+
+        self.session = session
+        self.connects += 1
+
+    def send(self, msg):
+        if self.session is None:
+            self.connect()
+
+        try:
+            self.session.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError):
+            # The relay drops idle sessions, so reconnect once before giving up on the message
+            self.close()
+            self.connect()
+            self.session.send_message(msg)
+
+    def close(self):
+        if self.session is None:
+            return
+
+        try:
+            self.session.quit()
+        except (smtplib.SMTPException, OSError):
+            self.session.close()
+        self.session = None
+
+
+class MailQueue:
+    def __init__(self, maxsize=100, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.smtp_settings = {}
+        self.logger = logging.getLogger(__name__)
+        self.pid = None
+        self._queue = None
+        self._worker = None
+        self._sender = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def put(self, msg):
+        self._ensure_worker()
+
+        try:
+            self._queue.put_nowait((msg, perf_counter()))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            self.logger.error(f'Mail queue is full; dropped message to {msg["To"]}')
+            return False
+
+    def _ensure_worker(self):
+        # Worker threads do not survive a fork, so each worker process starts its own
+        with self._lock:
+            if self._worker is None or self.pid != os.getpid() or not self._worker.is_alive():
+                # A restarted thread carries on with the messages already queued in this process
+                if self._queue is None or self.pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.maxsize)
+                self.pid = os.getpid()
+                self._sender = SMTPSender(**self.smtp_settings)
+                self._worker = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Let an idle session go rather than have the relay time it out
+                self._sender.close()
+                continue
+
+            if item is None:
+                self._sender.close()
+                self._queue.task_done()
+                return
+
+            msg, queued = item
+            try:
+                self._sender.send(msg)
+                latency = perf_counter() - queued
+                with self._lock:
+                    self.sent += 1
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+            except Exception as e:
+                # Anything escaping here would end the thread, and with it every later message
+                with self._lock:
+                    self.failed += 1
+                self._sender.close()
+                self.logger.error(f'Failed to send email to {msg["To"]}: {e}')
+            finally:
+                self._queue.task_done()
+
+    def stop(self, timeout=10):
+        if self._worker is None or self.pid != os.getpid() or not self._worker.is_alive():
+            return
+
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._worker.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return self._stats()
+
+    def _stats(self):
+        return {
+            'pid': self.pid,
+            'worker_alive': self._worker is not None and self._worker.is_alive(),
+            'queued': self._queue.qsize() if self._queue else 0,
+            'max_queued': self.maxsize,
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'smtp_connects': self._sender.connects if self._sender else 0,
+            'average_latency_ms': round(1000 * self.total_latency / self.sent, 3) if self.sent else 0.0,
+            'max_latency_ms': round(1000 * self.max_latency, 3)
+        }
+
+
+mail_queue = MailQueue()
+
+
+@atexit.register
+def stop_mail_queue_on_exit():
+    mail_queue.stop()
+
+
+def init_app(app):
+    mail_queue.maxsize = app.config.get('EMAIL_QUEUE_SIZE', 100)
+    mail_queue.idle_timeout = app.config.get('SMTP_IDLE_TIMEOUT', 60)
+    mail_queue.logger = app.logger
+    # Point SMTP_HOST/SMTP_PORT at a local stand-in, e.g. `python -m aiosmtpd -n`, with SMTP_STARTTLS = False for testing
+    mail_queue.smtp_settings = {
+        'host': app.config.get('SMTP_HOST', 'email-smtp.eu-west-2.amazonaws.com'),
+        'port': app.config.get('SMTP_PORT', 587),
+        'user': app.config.get('SMTP_USER'),
+        'password': app.config.get('SMTP_PASS'),
+        'starttls': app.config.get('SMTP_STARTTLS', True),
+        'timeout': app.config.get('SMTP_TIMEOUT', 10)
+    }
@@ -0,0 +1,6 @@
+from pandas import DataFrame
+
+
+class QueryResult(DataFrame):
+    def __bool__(self):
+        return not self.empty
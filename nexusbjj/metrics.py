@@ -0,0 +1,142 @@
+from flask import g, request
+from functools import lru_cache
+from time import perf_counter
+import os
+import re
+import threading
+
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@lru_cache(maxsize=1024)
+def normalise_sql(query):
+    # Group statements that differ only in their literals or in the length of IN/VALUES lists
+    query = ' '.join(query.split())
+    query = re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", '?', query)
+    query = re.sub(r'\b\d+(?:\.\d+)?\b', '?', query)
+    query = query.replace('%s', '?')
+    query = re.sub(r'\(\?(?:, \?)*\)(?:, \(\?(?:, \?)*\))*', '(...)', query)
+    query = re.sub(r'(?:WHEN \? THEN \? )+', 'WHEN ? THEN ? ', query)
+    return query
+
+
+class Histogram:
+    def __init__(self, buckets=REQUEST_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[n] += 1
+                break
+
+
+class Metrics:
+    def __init__(self, slow_query_seconds=0.5):
+        self.slow_query_seconds = slow_query_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.statements = {}
+        self.requests = {}
+        self.request_queries = {}
+
+    def _check_pid(self):
+        # Series recorded by the master before forking would otherwise be reported by every worker
+        if self.pid != os.getpid():
+            self.reset()
+
+    def record_statement(self, query, seconds, rows):
+        statement = normalise_sql(query)
+
+        with self._lock:
+            self._check_pid()
+            stats = self.statements.setdefault(statement, [0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += max(rows, 0)
+
+    def record_request(self, endpoint, seconds, queries):
+        with self._lock:
+            self._check_pid()
+            self.requests.setdefault(endpoint, Histogram()).observe(seconds)
+            self.request_queries[endpoint] = self.request_queries.get(endpoint, 0) + queries
+
+    def render(self):
+        # Prometheus text exposition format; each worker process keeps its own series, labelled by pid
+        worker = f'worker="{os.getpid()}"'
+        lines = [
+            '# HELP nexusbjj_sql_statements_total SQL statements executed, by normalised statement.',
+            '# TYPE nexusbjj_sql_statements_total counter'
+        ]
+
+        with self._lock:
+            self._check_pid()
+            statements = {statement: list(stats) for statement, stats in self.statements.items()}
+            requests = {endpoint: (list(histogram.counts), histogram.count, histogram.sum)
+                        for endpoint, histogram in self.requests.items()}
+            request_queries = dict(self.request_queries)
+
+        for statement, (count, seconds, rows) in statements.items():
+            lines.append(f'nexusbjj_sql_statements_total{{{worker},statement="{escape_label(statement)}"}} {count}')
+        lines += ['# HELP nexusbjj_sql_duration_seconds_total Time spent executing SQL statements.',
+                  '# TYPE nexusbjj_sql_duration_seconds_total counter']
+        for statement, (count, seconds, rows) in statements.items():
+            lines.append(f'nexusbjj_sql_duration_seconds_total{{{worker},statement="{escape_label(statement)}"}} {seconds:.6f}')
+        lines += ['# HELP nexusbjj_sql_rows_total Rows returned or affected by SQL statements.',
+                  '# TYPE nexusbjj_sql_rows_total counter']
+        for statement, (count, seconds, rows) in statements.items():
+            lines.append(f'nexusbjj_sql_rows_total{{{worker},statement="{escape_label(statement)}"}} {rows}')
+
+        lines += ['# HELP nexusbjj_request_duration_seconds Request latency by endpoint.',
+                  '# TYPE nexusbjj_request_duration_seconds histogram']
+        for endpoint, (counts, count, total) in requests.items():
+            labels = f'{worker},endpoint="{escape_label(endpoint)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(REQUEST_BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f'nexusbjj_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'nexusbjj_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'nexusbjj_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'nexusbjj_request_duration_seconds_count{{{labels}}} {count}')
+
+        lines += ['# HELP nexusbjj_request_queries_total SQL statements issued while serving requests, by endpoint.',
+                  '# TYPE nexusbjj_request_queries_total counter']
+        for endpoint, queries in request_queries.items():
+            lines.append(f'nexusbjj_request_queries_total{{{worker},endpoint="{escape_label(endpoint)}"}} {queries}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+def start_request_timer():
+    g.request_started = perf_counter()
+
+
+def record_request(e=None):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+
+    db = g.get('db')
+    metrics.record_request(request.endpoint or 'unmatched', perf_counter() - started, db.statement_count if db else 0)
+
+
+def init_app(app):
+    metrics.slow_query_seconds = app.config.get('SLOW_QUERY_MS', 500) / 1000
+    app.before_request(start_request_timer)
+    app.teardown_request(record_request)
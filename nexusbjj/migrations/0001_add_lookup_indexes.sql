@@ -0,0 +1,10 @@
+-- Index the columns used to look up users, password reset tokens and attendance.
+-- The unique email key will fail if duplicate emails exist; remove them before migrating.
+ALTER TABLE users MODIFY email VARCHAR(255) NOT NULL, ADD UNIQUE KEY users_email (email);
+
+ALTER TABLE password_resets MODIFY token VARCHAR(128) NOT NULL, ADD INDEX password_resets_token (token);
+
+ALTER TABLE attendance
+    ADD INDEX attendance_date (date),
+    ADD INDEX attendance_user_date (user_id, date),
+    ADD INDEX attendance_class_date (class_id, date);
@@ -0,0 +1,24 @@
+-- Attendance counts per class per day and per user per ISO week (identified by its Monday).
+-- Database.check_in_many and remove_check_ins keep them in step with attendance.
+CREATE TABLE class_attendance_daily (
+    class_id INTEGER NOT NULL,
+    class_date DATE NOT NULL,
+    attendees INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (class_id, class_date),
+    INDEX class_attendance_daily_date (class_date)
+);
+
+CREATE TABLE user_attendance_weekly (
+    user_id INTEGER NOT NULL,
+    week_start DATE NOT NULL,
+    attendances INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, week_start),
+    INDEX user_attendance_weekly_week (week_start)
+);
+
+INSERT INTO class_attendance_daily (class_id, class_date, attendees)
+SELECT class_id, class_date, COUNT(*) FROM attendance GROUP BY class_id, class_date;
+
+INSERT INTO user_attendance_weekly (user_id, week_start, attendances)
+SELECT user_id, DATE_SUB(class_date, INTERVAL WEEKDAY(class_date) DAY) week_start, COUNT(*) FROM attendance
+GROUP BY user_id, week_start;
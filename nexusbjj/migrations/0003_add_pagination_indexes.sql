@@ -0,0 +1,9 @@
+-- Index the sort orders used by the paginated users list and attendance reports.
+-- Names become VARCHAR so that they can be indexed in full.
+ALTER TABLE users
+    MODIFY first_name VARCHAR(255) NOT NULL,
+    MODIFY last_name VARCHAR(255) NOT NULL,
+    ADD INDEX users_name (last_name, first_name),
+    ADD INDEX users_last_access (last_access);
+
+ALTER TABLE attendance ADD INDEX attendance_class_date_time (class_date, class_time);
@@ -0,0 +1,15 @@
+-- Store the weekday as an ordinal (Monday is 0, as in WEEKDAY() and Python's date.weekday()) and persist each class's
+-- end time, so the timetable is read from the (weekday, age_group_id, time) index without computing anything per row.
+ALTER TABLE classes
+    ADD COLUMN weekday_number TINYINT NOT NULL DEFAULT 0 AFTER weekday,
+    ADD COLUMN end_time TIME NOT NULL DEFAULT "00:00:00" AFTER duration;
+
+UPDATE classes
+SET weekday_number = FIELD(weekday, "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday") - 1,
+    end_time = ADDTIME(time, duration);
+
+ALTER TABLE classes
+    DROP COLUMN weekday,
+    CHANGE weekday_number weekday TINYINT NOT NULL,
+    ALTER COLUMN end_time DROP DEFAULT,
+    ADD INDEX classes_timetable (weekday, age_group_id, time);
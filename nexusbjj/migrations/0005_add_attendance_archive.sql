@@ -0,0 +1,16 @@
+-- Closed years of attendance, moved out of the attendance table by `flask archive-attendance`.
+-- The columns match attendance so that the two tables can be read together with UNION ALL.
+CREATE TABLE attendance_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    date DATETIME NOT NULL,
+    class_id INTEGER NOT NULL,
+    class_date DATE NOT NULL,
+    class_time TIME NOT NULL,
+    INDEX attendance_archive_date (date),
+    INDEX attendance_archive_user_date (user_id, date),
+    INDEX attendance_archive_class_date (class_id, date),
+    INDEX attendance_archive_class_date_time (class_date, class_time),
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    FOREIGN KEY (class_id) REFERENCES classes (id)
+);
@@ -0,0 +1,32 @@
+from flask import current_app, request
+
+
+def get_page_args(sort_options, default_sort):
+    max_page_size = current_app.config.get('MAX_PAGE_SIZE', 200)
+    per_page = request.args.get('per_page', current_app.config.get('PAGE_SIZE', 50), type=int)
+    sort = request.args.get('sort', default_sort)
+
+    return {
+        'sort': sort if sort in sort_options else default_sort,
+        'descending': request.args.get('order') == 'desc',
+        'cursor': request.args.get('cursor'),
+        'backwards': request.args.get('direction') == 'prev',
+        'limit': min(max(per_page, 1), max_page_size)
+    }
+
+
+def get_page_links(next_cursor, previous_cursor, sort_options):
+    # Carry the current query string over to the next/previous and sort links
+    args = {key: value for key, value in request.args.items() if key not in ('cursor', 'direction')}
+    links = {'sort': {}}
+
+    if next_cursor:
+        links['next'] = dict(args, cursor=next_cursor, direction='next')
+    if previous_cursor:
+        links['previous'] = dict(args, cursor=previous_cursor, direction='prev')
+
+    for sort, label in sort_options.items():
+        links['sort'][label] = dict(args, sort=sort)
+
+    links['order'] = dict(args, order='asc' if args.get('order') == 'desc' else 'desc')
+    return links
@@ -1,8 +1,9 @@
 import functools
 from flask import Blueprint, flash, g, render_template, request, session
-from flask import url_for, redirect, escape, make_response
+from flask import url_for, redirect, make_response
+from markupsafe import escape
 from werkzeug.security import check_password_hash, generate_password_hash
-from nexusbjj.db import get_db, QueryResult
+from nexusbjj.db import get_db, access_times, flush_access_times
 from nexusbjj.forms import gen_form_item, gen_options
 from datetime import datetime, timedelta
 from secrets import token_urlsafe
@@ -45,8 +46,7 @@ def register():
 
 def get_registration_form(email='', first_name='', last_name='', mobile='', membership_id=''):
     db = get_db()
-    memberships = QueryResult(db.get_membership_types())
-    membership_types = (memberships['name'].str.capitalize() + ' - ' + memberships['membership_type'].str.capitalize()).tolist()
+    membership_types, membership_ids = db.get_membership_options()
     groups = {
         'user': {
             'group_title': 'Register',
@@ -59,8 +59,7 @@ def get_registration_form(email='', first_name='', last_name='', mobile='', memb
             'email': gen_form_item('email', label='Email', value=email,
                                       required=True, placeholder='Required', item_type='email'),
             'membership': gen_form_item('membership_type', label='Membership Type', field_type='select',
-                                        options=gen_options(membership_types, 
-                                                            values=memberships['id'].values.tolist()), 
+                                        options=gen_options(membership_types, values=membership_ids),
                                         selected_option=membership_id),
             'password': gen_form_item('password', label='Password', placeholder='Required',
                                       required=True, item_type='password'),
@@ -80,10 +79,9 @@ def login(check_in=True):
     status_code = 200
     referrer = request.args.get('next')
     db = get_db()
-    user = db.get_user()
+    user = g.user
 
     if user:
-        print(user)
         if user.get('is_coach'):
             return redirect(url_for('reports.headcount'))
         else:
@@ -229,7 +227,7 @@ def generate_password_reset(email):
         text_body = text_body.format(domain, url_for('auth.initiate_password_reset', token=token))
         email_body = render_template('reset_email.html', token=token, domain=domain)
         msg = Email(to=user['email'], text_body=text_body, html_body=email_body)
-        msg.send_message()
+        msg.queue()
 
     message = '<p>A password reset link has been emailed to the email address you entered, provided it is linked to an account.</p>'
     message += '<p>Please follow the steps in the email to reset your password (check your junk folder if the email does not appear in your '
@@ -250,7 +248,7 @@ def load_logged_in_user():
     if user_id is None:
         g.user = None
     else:
-        g.user = get_db().get_user(uid=user_id)
+        g.user = get_db().get_session_user(user_id)
 
 
 @bp.before_app_request
@@ -349,5 +347,5 @@ def redirect_to_referrer(url='auth.login', **kwargs):
 @bp.before_app_request
 def update_access_time():
     if g.user is not None:
-        db = get_db()
-        db.update_user_access_time(g.user['id'])
+        access_times.record(g.user['id'])
+        flush_access_times()
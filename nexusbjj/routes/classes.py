@@ -1,10 +1,10 @@
-from flask import Blueprint, request, render_template, flash, g
+from flask import Blueprint, current_app, request, render_template, flash, g
 from nexusbjj.routes.auth import admin_required, login_required
 from nexusbjj.forms import gen_form_item, gen_options
-from nexusbjj.db import get_db, QueryResult
-from datetime import datetime, time
+from nexusbjj.db import get_db
+from nexusbjj.tables import render_table
+from datetime import datetime
 from calendar import day_name
-from pandas import Categorical
 
 
 bp = Blueprint('classes', __name__, url_prefix='/classes', template_folder='templates/classes')
@@ -14,122 +14,88 @@ bp = Blueprint('classes', __name__, url_prefix='/classes', template_folder='temp
 @login_required
 def check_in_to_class():
     db = get_db()
-    current_user = db.get_user()
+    current_user = g.user
     today = datetime.today()
-    today_start = datetime.combine(today.date(), time.fromisoformat('00:00:00')).isoformat()
-    today_end = datetime.combine(today.date(), time.fromisoformat('23:59:59')).isoformat()
-    current_user_attendance = QueryResult(db.get_attendance(from_date=today_start, to_date=today_end,
-                                          user_id=current_user['id']))
-
-    try:
-        request_class_id = int(request.args.get('class_id'))
-    except:
-        request_class_id = request.args.get('class_id')
-    classes = QueryResult(db.get_classes(age_group=current_user['age_group_id']))
-    
+    classes = db.get_classes(age_group=current_user['age_group_id'])
+
     if not classes:
         flash('No classes available')
         return render_template('checkin.html')
-    
-    
-    classes.sort_values(by=['class_time'], inplace=True)
-    df_classes = check_attendance(classes.set_index('id'), current_user_attendance)
-    df_classes['class_date'] = today.date().isoformat()
-
-    if request_class_id:
-        toggle_check_in(df_classes, request_class_id, current_user['id'])
 
-    flag_all_classes_attended = all(df_classes['attendance'])
-    
-    return render_template('checkin.html', classes=df_classes.reset_index().to_dict('records'), 
-                           all_classes_attended=flag_all_classes_attended)
+    checked_in = db.get_checked_in_class_ids(current_user['id'], today)
+    for bjj_class in classes:
+        bjj_class['attendance'] = bjj_class['id'] in checked_in
+        bjj_class['class_date'] = today.date().isoformat()
 
+    request_class_id = request.args.get('class_id')
+    if request_class_id:
+        toggle_check_in(classes, request_class_id, current_user['id'])
 
-def check_attendance(classes: QueryResult, user_attendance: QueryResult) -> QueryResult:
-    if user_attendance:
-        classes['attendance'] = classes.index.to_series().apply(lambda x: x in user_attendance['class_id'].values)
-    else:
-        classes['attendance'] = False
-    return classes
+    return render_template('checkin.html', classes=classes,
+                           all_classes_attended=all(bjj_class['attendance'] for bjj_class in classes))
 
 
-def toggle_check_in(df_classes: QueryResult, class_id, user_id):
+def toggle_check_in(classes, class_id, user_id):
     db = get_db()
-    df_classes['check_in_function'] = 'no operation'
 
     if class_id == 'all':
-        if all(df_classes['attendance']):
-            df_classes['check_in_function'] = db.remove_check_in
-            df_classes['attendance'] = False
-        elif not any(df_classes['attendance']):
-            df_classes['check_in_function'] = db.check_in
-            df_classes['attendance'] = True
-        else:
-            mask = df_classes['attendance'] == False
-            df_classes.loc[mask, 'check_in_function'] = db.check_in
-            df_classes.loc[mask, 'attendance'] = True
+        attended = all(bjj_class['attendance'] for bjj_class in classes)
+        selected = [bjj_class for bjj_class in classes if bjj_class['attendance'] == attended]
     else:
-        if df_classes.loc[class_id, 'attendance']:
-            df_classes.loc[class_id, 'check_in_function'] = db.remove_check_in
-            df_classes.loc[class_id, 'attendance'] = False
-        else:
-            df_classes.loc[class_id, 'check_in_function'] = db.check_in
-            df_classes.loc[class_id, 'attendance'] = True
+        selected = [bjj_class for bjj_class in classes if str(bjj_class['id']) == class_id]
+        if not selected:
+            flash('Class not found')
+            return
+        attended = selected[0]['attendance']
 
-    for row in df_classes[df_classes['check_in_function'] != 'no operation'].itertuples():
-        row.check_in_function(row.Index, user_id, row.class_date, row.class_time)
+    rows = [(bjj_class['id'], bjj_class['class_date'], bjj_class['class_time']) for bjj_class in selected]
+
+    if attended:
+        db.remove_check_ins(user_id, rows)
+    else:
+        db.check_in_many(user_id, rows)
+
+    for bjj_class in selected:
+        bjj_class['attendance'] = not attended
 
 
 @bp.route('/')
 @login_required
 def show_classes():
     db = get_db()
-    classes = QueryResult(db.get_all_classes())
-    columns = ['class_name', 'weekday', 'class_time', 'end_time']
+    subtitle = None
 
     if g.user['admin'] in g.admin_levels:
-        attendance = QueryResult(db.get_attendance())
-        if attendance:
-            attendance = attendance.set_index('check_in_time').groupby('class_id')\
-                                   .resample('1W-MON', label='left')['user_id'].count().unstack().fillna(0)
-            attendance['avg_weekly_attendance'] = attendance.mean(axis='columns').round(2)
-            attendance = QueryResult(attendance.reset_index()[['class_id', 'avg_weekly_attendance']])
-            columns.append('avg_weekly_attendance')
-    else:
-        attendance = QueryResult(db.get_attendance(user_id=g.user['id']))
-        columns.append('Attendances')
-    
-        if attendance:
-            attendance = attendance[['class_id', 'user_id']].rename(columns={'user_id': 'Attendances'})
-            attendance = QueryResult(attendance.groupby('class_id').count().reset_index())
-
-    if attendance:        
-        classes = QueryResult(classes.merge(attendance, on='class_id', how='left'))
+        weeks = request.args.get('weeks', current_app.config.get('CLASS_ATTENDANCE_WEEKS', 12), type=int)
+        weeks = max(weeks, 1)
+        attendance = {row['class_id']: row['avg_weekly_attendance'] for row in db.get_average_weekly_attendance(weeks)}
+        subtitle = f'Average weekly attendance over the last {weeks} weeks'
+        attendance_column = 'avg_weekly_attendance' if attendance else None
     else:
-        classes['Attendances'] = 0
-
-    if classes:
-        classes = classes[columns].fillna(0)
-        classes['weekday'] = Categorical(classes['weekday'], categories=list(day_name), ordered=True)
-        classes.sort_values(by=['weekday', 'class_time', 'class_name'], inplace=True)
-        classes.rename(columns={
-            'class_name': 'Class',
-            'weekday': 'Day',
-            'class_time': 'Start Time',
-            'end_time': 'Finish Time'
-        }, inplace=True)
+        attendance = db.get_user_class_attendances(g.user['id'])
+        attendance_column = 'Attendances'
+
+    # get_all_classes already orders the timetable by weekday ordinal, start time and name
+    classes = []
+    for bjj_class in db.get_all_classes():
+        row = {
+            'Class': bjj_class['class_name'],
+            'Day': day_name[bjj_class['weekday']],
+            'Start Time': bjj_class['class_time'],
+            'Finish Time': bjj_class['end_time']
+        }
+        if attendance_column:
+            row[attendance_column] = attendance.get(bjj_class['class_id'], 0)
+        classes.append(row)
 
-        if g.user['admin'] not in g.admin_levels:
-            classes['Attendances'] = classes['Attendances'].astype(int)
-    return render_template('classes.html', table_data=QueryResult(classes), table_title='Classes')
+    return render_table('classes.html', classes, table_title='Classes', table_subtitle=subtitle)
 
 
 @bp.route('/add-class', methods=['GET', 'POST'])
 @admin_required
 def add_class():
     db = get_db()
-    coaches = QueryResult(db.get_coaches())
-    coaches['full_name'] = coaches['first_name'].str.cat(coaches['last_name'], sep=' ')
+    coach_names, coach_ids = db.get_coach_options()
     groups = {
         'class': {
             'group_title': 'Add Class',
@@ -138,11 +104,9 @@ def add_class():
                                         options=gen_options(('No Gi', 'Gi')), value='No Gi',
                                         selected_option='No Gi'),
             'class_coach': gen_form_item('class_coach', label='Coach', field_type='select',
-                                         options=gen_options(coaches['full_name'].to_list(), 
-                                         values=coaches['id'].to_list())),
+                                         options=gen_options(coach_names, values=coach_ids)),
             'class_day': gen_form_item('class_day', label='Day', field_type='select',
-                                       options=gen_options(('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
-                                                            'Saturday', 'Sunday'))),
+                                       options=gen_options(list(day_name), values=list(range(len(day_name))))),
             'class_time': gen_form_item('class_time', label='Time (24h)', item_type='time'),
             'class_duration': gen_form_item('class_duration', label='Duration', item_type='time', value="01:00")
         },
@@ -156,7 +120,7 @@ def add_class():
         class_name = form.get('class_name')
         class_type = form.get('class_type')
         class_coach_id = form.get('class_coach')
-        class_day = form.get('class_day')
+        class_day = form.get('class_day', type=int)
         class_time = form.get('class_time')
         class_duration = form.get('class_duration')
 
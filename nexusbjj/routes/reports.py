@@ -1,40 +1,43 @@
-from flask import Blueprint, make_response, redirect, request, render_template, flash, url_for
+from flask import Blueprint, Response, current_app, make_response, redirect, request, render_template, flash, url_for, stream_with_context
 from nexusbjj.routes.auth import admin_required
 from nexusbjj.forms import gen_form_item
-from nexusbjj.db import get_db, QueryResult
+from nexusbjj.db import get_db, get_pool, get_replica_pool, get_week_start, reference_cache, report_cache, timetable, user_cache, QueryResult, ATTENDANCE_COLUMNS, ATTENDANCE_SORT_COLUMNS
+from nexusbjj.pagination import get_page_args, get_page_links
+from nexusbjj.tables import render_table
+from nexusbjj.email import mail_queue
+from nexusbjj.metrics import metrics
 from datetime import datetime, timedelta
-from typing import Tuple
-import pandas as pd
+from typing import TYPE_CHECKING, Tuple
+from csv import writer as csv_writer
+from io import StringIO
+from hmac import compare_digest
+
+if TYPE_CHECKING:
+    # pandas is only imported by the views that build a DataFrame
+    import pandas as pd
 
 
 bp = Blueprint('reports', __name__, url_prefix='/reports', template_folder='templates/reports')
+BRIEF_COLUMNS = ('class_name', 'full_name', 'check_in_time')
+REPORT_COLUMNS = ('class_name', 'class_date', 'class_time', 'full_name', 'check_in_time', 'membership_type')
+ATTENDANCE_SORT_OPTIONS = {'class': 'Class', 'check_in_time': 'Check-in time'}
 
 
 # Attendance Reports
 
 @bp.route('/attendance/headcount')
 @admin_required
-def headcount(export_to_csv=False):
+def headcount():
     today = datetime.today()
     db = get_db()
     class_date = today.strftime('%A, %d %b %Y')
-    results, error = get_attendance(today.isoformat(), today.isoformat(), headcount=True)
-    if results:
-        summary = QueryResult(results[['class_name', 'user_id']].groupby('class_name').count().reset_index()\
-                                                                .rename(columns={
-                                                                    'class_name': 'Class',
-                                                                    'user_id': 'Attendees'
-                                                                }))
-    else:
-        summary = QueryResult(db.get_classes(weekday=today.strftime('%A')))
-        if summary:
-            summary['Attendees'] = 0
-            summary = summary[['class_name', 'Attendees']]
-            summary.rename(columns={'class_name': 'Classes'})
-        else:
-            flash(f'No classes found for {class_date}.')
-            return render_template('report.html')
+    summary = QueryResult(db.get_class_headcounts(today))
 
+    if not summary:
+        flash(f'No classes found for {class_date}.')
+        return render_template('report.html')
+
+    summary = summary.rename(columns={'class_name': 'Class', 'attendees': 'Attendees'})
     return get_report_template(QueryResult(summary), today, today, 'Headcount', 'Headcount', to_csv=False)
 
 
@@ -55,11 +58,16 @@ def attendance_custom():
     }
 
     if request.method == 'POST':
-        start_date = datetime.fromisoformat(request.form.get('start_date'))
-        end_date = datetime.fromisoformat(request.form.get('end_date'))
-        results, error = get_attendance(start_date, end_date)
+        # Redirect so that the page links can carry the dates in the query string
+        return redirect(url_for('reports.attendance_custom', start_date=request.form.get('start_date'),
+                                end_date=request.form.get('end_date')))
+
+    if request.args.get('start_date') and request.args.get('end_date'):
+        start_date = datetime.fromisoformat(request.args.get('start_date'))
+        end_date = datetime.fromisoformat(request.args.get('end_date'))
+        results, error, page_links = get_attendance_page(start_date, end_date)
         if results:
-            return get_report_template(results, start_date, end_date, 'custom')
+            return get_report_template(results, start_date, end_date, 'custom', page_links=page_links)
         else:
             flash(error)
 
@@ -68,15 +76,12 @@ def attendance_custom():
 
 @bp.route('/attendance/today')
 @admin_required
-def attendance_today(export_to_csv=False):
+def attendance_today():
     today = datetime.today()
-    results, error = get_attendance(today, today, brief=True)
-
-    if export_to_csv:
-        return results
+    results, error, page_links = get_attendance_page(today, today, brief=True)
 
     if results:
-        return get_report_template(results, today, today, 'today')
+        return get_report_template(results, today, today, 'today', page_links=page_links)
     else:
         flash(error)
         return redirect(url_for('reports.attendance_custom'))
@@ -84,15 +89,12 @@ def attendance_today(export_to_csv=False):
 
 @bp.route('/attendance/yesterday')
 @admin_required
-def attendance_yesterday(export_to_csv=False):
+def attendance_yesterday():
     yesterday = (datetime.today() - timedelta(days=1))
-    results, error = get_attendance(yesterday, yesterday, brief=True)
-
-    if export_to_csv:
-        return results
+    results, error, page_links = get_attendance_page(yesterday, yesterday, brief=True)
 
     if results:
-        return get_report_template(results, yesterday, yesterday, 'yesterday')
+        return get_report_template(results, yesterday, yesterday, 'yesterday', page_links=page_links)
     else:
         flash(error)
         return redirect(url_for('reports.attendance_custom'))
@@ -100,17 +102,14 @@ def attendance_yesterday(export_to_csv=False):
 
 @bp.route('/attendance/last-week')
 @admin_required
-def attendance_last_week(export_to_csv=False):
+def attendance_last_week():
     today = datetime.today()
     last_sunday = today - timedelta(days=today.weekday()+1)
     last_monday = last_sunday - timedelta(days=7)
-    results, error = get_attendance(last_monday, last_sunday)
-
-    if export_to_csv:
-        return results
+    results, error, page_links = get_attendance_page(last_monday, last_sunday)
 
     if results:
-        return get_report_template(results, last_monday, last_sunday, 'last_week')
+        return get_report_template(results, last_monday, last_sunday, 'last_week', page_links=page_links)
     else:
         flash(error)
         return redirect(url_for('reports.attendance_custom'))
@@ -118,17 +117,14 @@ def attendance_last_week(export_to_csv=False):
 
 @bp.route('/attendance/last-month')
 @admin_required
-def attendance_last_month(export_to_csv=False):
+def attendance_last_month():
     today = datetime.today()
     first_of_month = datetime(today.year, today.month - 1, 1)
     last_of_month = datetime(today.year, today.month, day=1) - timedelta(days=1)
-    results, error = get_attendance(first_of_month, last_of_month)
-
-    if export_to_csv:
-        return results
+    results, error, page_links = get_attendance_page(first_of_month, last_of_month)
 
     if results:
-        return get_report_template(results, first_of_month, last_of_month, 'last_month')
+        return get_report_template(results, first_of_month, last_of_month, 'last_month', page_links=page_links)
     else:
         flash(error)
         return redirect(url_for('reports.attendance_custom'))
@@ -142,53 +138,112 @@ def attendance_last_month(export_to_csv=False):
 def absentees(export_to_csv=False):
     db = get_db()
     today = datetime.today()
-    start = today - timedelta(days=14)
+    days = max(request.args.get('days', 14, type=int), 0)
+    start = today - timedelta(days=days)
     title = 'Absentees'
     sub_title = f'No classes attended since {format_time(start)}'
-    attendance = QueryResult(pd.DataFrame(db.get_absentees(from_date=start)).fillna('None'))
+    attendance = QueryResult(db.get_absentees(from_date=start)).fillna('None')
 
     if export_to_csv:
         return attendance
 
-    return render_template('report.html', table_data=attendance, page_title=title, table_title=title, table_subtitle=sub_title, to_csv=True,
-                           report='absentees', start_date=today.date().isoformat(), end_date=today.date().isoformat())
+    return render_table('report.html', attendance, page_title=title, table_title=title, table_subtitle=sub_title, to_csv=True,
+                        report='absentees', start_date=today.date().isoformat(), end_date=today.date().isoformat(),
+                        csv_args={'days': days})
 
 
-@bp.route('/users/exceeding-membership-limit')
+@bp.route('/users/exceeding-membership-limit', methods=['GET', 'POST'])
 @admin_required
 def users_exceeding_membership_limit(export_to_csv=False):
+    db = get_db()
     today = datetime.today()
-    start_of_month = today.replace(day=1)
-    end_of_last_month = start_of_month - timedelta(days=1)
-    start_of_last_month = end_of_last_month.replace(day=1)
-    
-    user_attendance_this_month, error = get_attendance(start_of_last_month, today, headcount=True, extra_query_columns=['sessions_per_week'],
-                                                       extra_result_columns=['sessions_per_week'])
-    users = user_attendance_this_month[['user_id', 'full_name']].drop_duplicates()
-
-    df_analysis = user_attendance_this_month.set_index('check_in_time').groupby('user_id').resample('1W-MON', label='left')\
-                                            .agg({'class_id': 'count', 'sessions_per_week': 'min'})\
-                                            .rename(columns={'class_id':'attendance'}).unstack().fillna(0)
-    df_analysis['sessions', 'weekly_average'] = df_analysis['attendance'].mean(axis='columns').round(2)
-    df_analysis['sessions', 'limit'] = df_analysis['sessions_per_week'].max(axis=1).astype(int)
-    df_analysis= df_analysis[df_analysis['sessions', 'weekly_average'] > df_analysis['sessions', 'limit']]
-    attendance = df_analysis['attendance'].astype(int)
-    df_analysis.drop(columns=['sessions_per_week', 'attendance'], inplace=True)
-    df_analysis.columns.names = [None, None]
-
-    column_index = pd.MultiIndex.from_product([['attendance'], pd.to_datetime(attendance.columns).date], names=[None, None])
-    row_index = pd.merge(pd.Series(df_analysis.index, name='user_id'), users, on='user_id')['full_name']
-
-    df_analysis = df_analysis.join(pd.DataFrame(attendance.to_numpy(), index=attendance.index, columns=column_index))
-    df_analysis.index = row_index
-    df_analysis.index.name = None
+    end_of_last_month = today.replace(day=1) - timedelta(days=1)
+    values = request.form if request.method == 'POST' else request.args
+    start_date = datetime.fromisoformat(values.get('start_date') or end_of_last_month.replace(day=1).date().isoformat())
+    end_date = datetime.fromisoformat(values.get('end_date') or today.date().isoformat())
+    groups = {
+        'dates': {
+            'start_picker': gen_form_item('start_date', label='Start Date', item_type='date', required=True,
+                                          value=start_date.date().isoformat()),
+            'end_picker': gen_form_item('end_date', label='End Date', item_type='date', required=True,
+                                        value=end_date.date().isoformat())
+        },
+        'submit': {
+            'btn-submit': gen_form_item('btn-submit', item_type='submit', value='Submit')
+        }
+    }
+
+    weekly_attendance = db.get_weekly_user_attendance(start_date, end_date)
+    df_analysis = get_excess_attendance(weekly_attendance, start_date, end_date)
 
     if export_to_csv:
         return df_analysis.to_csv()
 
-    return render_template('report.html', table_html=df_analysis.to_html(classes='table'),
-                           table_title='Users Exceeding Membership Limit', page_title='Excess Sessions', report='excess_attendances',
-                           to_csv=True, start_date=start_of_last_month.date().isoformat(), end_date=today.date().isoformat()) 
+    return render_template('report.html', table_html=df_analysis.to_html(classes='table'), form_groups=groups,
+                           table_title='Users Exceeding Membership Limit', table_subtitle=format_start_and_end(start_date, end_date),
+                           page_title='Excess Sessions', report='excess_attendances', to_csv=True,
+                           start_date=start_date.date().isoformat(), end_date=end_date.date().isoformat())
+
+
+def get_excess_attendance(weekly_attendance, start_date, end_date) -> 'pd.DataFrame':
+    import numpy as np
+    import pandas as pd
+
+    first_week = np.datetime64(get_week_start(start_date), 'D')
+    weeks = np.arange(first_week, np.datetime64(get_week_start(end_date), 'D') + 1, 7)
+    rows = len(weekly_attendance)
+
+    user_ids = np.fromiter((row['user_id'] for row in weekly_attendance), dtype=np.int64, count=rows)
+    week_starts = np.array([row['week_start'] for row in weekly_attendance], dtype='datetime64[D]')
+    attendances = np.fromiter((row['attendances'] for row in weekly_attendance), dtype=np.int64, count=rows)
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    week_index = (week_starts - first_week).astype(np.int64) // 7
+
+    # Count every (user, week) cell in one pass, then compare each user's average with their limit
+    counts = np.bincount(user_index * len(weeks) + week_index, weights=attendances,
+                         minlength=len(users) * len(weeks)).reshape(len(users), len(weeks)).astype(np.int64)
+    limits = np.zeros(len(users), dtype=np.int64)
+    limits[user_index] = [row['sessions_per_week'] for row in weekly_attendance]
+    names = np.empty(len(users), dtype=object)
+    names[user_index] = [row['full_name'] for row in weekly_attendance]
+    averages = counts.mean(axis=1).round(2) if len(weeks) else np.zeros(len(users))
+    exceeding = averages > limits
+
+    sessions = pd.DataFrame({'weekly_average': averages[exceeding], 'limit': limits[exceeding]}, index=names[exceeding])
+    attendance = pd.DataFrame(counts[exceeding], index=names[exceeding], columns=weeks.astype(object))
+    return pd.concat({'sessions': sessions, 'attendance': attendance}, axis='columns')
+
+
+# System Reports
+
+
+@bp.route('/system')
+@admin_required
+def system_status():
+    today = datetime.today()
+    replica_pool = get_replica_pool()
+    stats = QueryResult(get_stats_rows('Database pool', get_pool().stats()) +
+                        (get_stats_rows('Replica pool', replica_pool.stats()) if replica_pool else []) +
+                        get_stats_rows('User cache', user_cache.stats()) +
+                        get_stats_rows('Report cache', report_cache.stats()) +
+                        get_stats_rows('Reference data cache', reference_cache.stats()) +
+                        get_stats_rows('Timetable cache', timetable.stats()) +
+                        get_stats_rows('Email queue', mail_queue.stats()))
+    return get_report_template(stats, today, today, 'system', 'System Status', to_csv=False)
+
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    # Scrapers authenticate with METRICS_TOKEN as a bearer token; people need an admin session
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return render_metrics()
+
+    return admin_required(render_metrics)()
+
+
+def render_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 # Helpers
@@ -199,10 +254,6 @@ def users_exceeding_membership_limit(export_to_csv=False):
 def csv():
     attendance_report_requested = request.args.get('report')
     attendance_function = {
-        'today': attendance_today,
-        'yesterday': attendance_yesterday,
-        'last_week': attendance_last_week,
-        'last_month': attendance_last_month,
         'excess_attendances': users_exceeding_membership_limit,
         'absentees': absentees
     }
@@ -215,75 +266,88 @@ def csv():
     
     filename += '.csv'
 
-    if attendance_report_requested == 'custom':
-        df_report = get_attendance(start_date, end_date)[0]
+    streamed_reports = {
+        'today': BRIEF_COLUMNS,
+        'yesterday': BRIEF_COLUMNS,
+        'last_week': REPORT_COLUMNS,
+        'last_month': REPORT_COLUMNS,
+        'custom': REPORT_COLUMNS
+    }
+
+    if attendance_report_requested in streamed_reports:
+        start = datetime.fromisoformat(start_date).replace(hour=0, minute=0, second=0)
+        end = datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59)
+        # Streamed straight from the database: the paged HTML view only ever caches one page, never the whole range
+        rows = stream_attendance(start, end, streamed_reports[attendance_report_requested])
+        response = Response(stream_with_context(stream_csv(rows)))
     else:
         df_report = attendance_function[attendance_report_requested](export_to_csv=True)
 
-    if not isinstance(df_report, str):
-        df_report = df_report.to_csv(index=False)
+        if not isinstance(df_report, str):
+            df_report = df_report.to_csv(index=False)
+
+        response = make_response(df_report)
 
-    response = make_response(df_report)
     response.headers['Content-Type'] = 'text/csv'
     response.headers['Content-Disposition'] = 'attachment; filename=' + filename
     return response
 
 
+def stream_attendance(start, end, columns):
+    # Only looked up once the stream starts: Flask 3.1 has already torn down the request's context by then, and closed its
+    # connection, so the stream gets one of its own from the streaming context; older versions hand back the same one
+    yield from get_db().iter_attendance(start, end, columns=columns)
 
-def get_attendance(start_date, end_date, brief=False, headcount=False, query_columns=None, extra_query_columns=None, 
-                   result_columns=None, extra_result_columns=None, sort=True) -> Tuple[QueryResult, str]:
-    error = ''
-    start_date = datetime.fromisoformat(start_date) if type(start_date) == str else start_date
-    end_date = datetime.fromisoformat(end_date) if type(end_date) == str else end_date
-    extra_args = {}
 
-    if query_columns:
-        extra_args['columns'] = query_columns
-    if extra_query_columns:
-        extra_args['extra_columns'] = extra_query_columns
+def stream_csv(rows, rows_per_chunk=500):
+    buffer = StringIO()
+    writer = csv_writer(buffer, lineterminator='\n')
 
-    if start_date == end_date:  
-        error = f'No classes were attended on {start_date.strftime("%A, %d %b %Y")}.'
-    else:
-        error = f'No classes were attended between {start_date.strftime("%A, %d %b %Y")} and '
-        error += f'{end_date.strftime("%A, %d %b %Y")}.'
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
 
-    start_date = start_date.replace(hour=0, minute=0, second=0)
-    end_date = end_date.replace(hour=23, minute=59, second=59)
-    db = get_db()
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
 
-    attendance_keyword_args = {}
-    if query_columns:
-        attendance_keyword_args['columns'] = query_columns
-    if extra_query_columns:
-        attendance_keyword_args['extra_columns'] = extra_query_columns
+    yield buffer.getvalue()
 
-    results = QueryResult(db.get_attendance(start_date, end_date, **attendance_keyword_args))
 
-    if results:
-        if sort:
-            results.sort_values(by=['class_date', 'class_time', 'class_name', 'check_in_time'], inplace=True)
-        
-        if brief:
-            columns= ['class_name', 'full_name', 'check_in_time']
-        elif result_columns:
-            columns = result_columns
-        else:
-            columns = ['class_name', 'class_date', 'class_time', 'full_name', 'check_in_time', 'membership_type']
-        
-        if headcount:
-            for col in ('class_id', 'user_id'):
-                if col not in columns:
-                    columns.append(col)
-
-        if extra_result_columns:
-            for col in extra_result_columns:
-                if col not in columns:
-                    columns.append(col)        
-        
-        results = QueryResult(results[columns])
-    
-    return results, error
+def get_attendance_page(start_date, end_date, brief=False) -> Tuple['pd.DataFrame', str, dict]:
+    start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=0)
+    columns = BRIEF_COLUMNS if brief else REPORT_COLUMNS
+    page_args = get_page_args(ATTENDANCE_SORT_COLUMNS, 'class')
+    cache_key = get_report_cache_key('attendance_page', start_date, end_date, columns) + tuple(page_args.values())
+    page = report_cache.get(cache_key)
+
+    if page is None:
+        rows, next_cursor, previous_cursor = get_db().get_attendance_page(
+            start_date, end_date, columns=[ATTENDANCE_COLUMNS[column] for column in columns], **page_args)
+        page = (QueryResult(rows, columns=list(columns)), next_cursor, previous_cursor)
+        report_cache.set(cache_key, page)
+
+    results, next_cursor, previous_cursor = page
+    page_links = get_page_links(next_cursor, previous_cursor, ATTENDANCE_SORT_OPTIONS)
+    return results, get_attendance_error(start_date, end_date), page_links
+
+
+def get_attendance_error(start_date, end_date):
+    if start_date.date() == end_date.date():
+        return f'No classes were attended on {start_date.strftime("%A, %d %b %Y")}.'
+
+    error = f'No classes were attended between {start_date.strftime("%A, %d %b %Y")} and '
+    error += f'{end_date.strftime("%A, %d %b %Y")}.'
+    return error
+
+
+def get_report_cache_key(report, start_date, end_date, columns):
+    return (report, start_date, end_date, tuple(columns))
+
+
+def get_stats_rows(component, stats):
+    return [{'Component': component, 'Statistic': key, 'Value': value} for key, value in stats.items()]
 
 
 def format_time(time):
@@ -300,8 +364,8 @@ def format_start_and_end(start_date, end_date):
     return result
 
 
-def get_report_template(results, start_date, end_date, report, title='Attendance', to_csv=True, show_index=False):
+def get_report_template(results, start_date, end_date, report, title='Attendance', to_csv=True, show_index=False, page_links=None):
     sub_title = format_start_and_end(start_date, end_date)
-    return render_template('report.html', table_data=results , page_title=title, table_title=title, table_subtitle=sub_title,
-                           start_date=start_date.date().isoformat(), end_date=end_date.date().isoformat(), to_csv=to_csv, report=report,
-                           show_index=show_index)
\ No newline at end of file
+    return render_table('report.html', results, show_index=show_index, page_title=title, table_title=title, table_subtitle=sub_title,
+                        start_date=start_date.date().isoformat(), end_date=end_date.date().isoformat(), to_csv=to_csv, report=report,
+                        page_links=page_links)
\ No newline at end of file
@@ -1,20 +1,27 @@
 from flask import Blueprint, flash, g, render_template, request, url_for
-from flask import redirect, escape
+from flask import redirect
+from markupsafe import escape
 from werkzeug.security import check_password_hash, generate_password_hash
-from nexusbjj.db import get_db, QueryResult
+from nexusbjj.db import get_db, flush_access_times, USER_SORT_COLUMNS
+from nexusbjj.pagination import get_page_args, get_page_links
+from nexusbjj.tables import render_table
 from nexusbjj.routes.auth import admin_required, write_admin_required, login_required
 from nexusbjj.forms import gen_form_item, gen_options
 
 
 bp = Blueprint('users', __name__, url_prefix='/users')
+USER_SORT_OPTIONS = {'last_name': 'Name', 'last_access': 'Last access', 'id': 'ID'}
 
 
 @bp.route('')
 @admin_required
 def show_all():
     db = get_db()
-    users = QueryResult(db.get_users(columns=('id', 'first_name', 'last_name', 'last_access')))
-    return render_template('users/list.html', table_data=users, table_title='Users')
+    flush_access_times(force=True)
+    page_args = get_page_args(USER_SORT_COLUMNS, 'last_name')
+    rows, next_cursor, previous_cursor = db.get_users_page(columns=('id', 'first_name', 'last_name', 'last_access'), **page_args)
+    page_links = get_page_links(next_cursor, previous_cursor, USER_SORT_OPTIONS)
+    return render_table('users/list.html', rows, table_title='Users', page_links=page_links)
 
 
 @bp.route('/<int:uid>/edit', methods=['GET', 'POST'])
@@ -138,9 +145,7 @@ def generate_form_groups(user):
     password_href = url_for('users.change_password', uid=user['id'])
     delete_href = url_for('users.delete', uid=user['id'])
     db = get_db()
-    memberships = QueryResult(db.get_membership_types())
-    membership_types = list(memberships['name'].str.capitalize() + ' - ' + memberships['membership_type'].str.capitalize())
-    membership_ids = list(memberships['id'])
+    membership_types, membership_ids = db.get_membership_options()
 
     groups = {
         'user': {
@@ -2,7 +2,11 @@ SET FOREIGN_KEY_CHECKS=0;
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS classes;
 DROP TABLE IF EXISTS attendance;
+DROP TABLE IF EXISTS attendance_archive;
 DROP TABLE IF EXISTS memberships;
+DROP TABLE IF EXISTS schema_migrations;
+DROP TABLE IF EXISTS class_attendance_daily;
+DROP TABLE IF EXISTS user_attendance_weekly;
 SET FOREIGN_KEY_CHECKS=1;
 
 CREATE TABLE age_groups (
@@ -32,10 +36,10 @@ VALUES
 
 CREATE TABLE users (
     id INTEGER PRIMARY KEY AUTO_INCREMENT,
-    email TEXT NOT NULL,
+    email VARCHAR(255) NOT NULL,
     password TEXT NOT NULL,
-    first_name TEXT NOT NULL,
-    last_name TEXT NOT NULL,
+    first_name VARCHAR(255) NOT NULL,
+    last_name VARCHAR(255) NOT NULL,
     mobile_number TEXT NOT NULL,
     grade TEXT,
     membership_id INTEGER NOT NULL,
@@ -43,6 +47,9 @@ CREATE TABLE users (
     created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     last_access TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     is_coach BOOLEAN NOT NULL DEFAULT false,
+    UNIQUE KEY users_email (email),
+    INDEX users_name (last_name, first_name),
+    INDEX users_last_access (last_access),
     FOREIGN KEY (membership_id) REFERENCES memberships (id)
 );
 
@@ -50,11 +57,13 @@ CREATE TABLE classes (
     id INTEGER PRIMARY KEY AUTO_INCREMENT,
     class_name TEXT NOT NULL,
     class_type TEXT NOT NULL,
-    weekday TEXT NOT NULL,
+    weekday TINYINT NOT NULL,
     time TIME NOT NULL,
     duration TIME NOT NULL DEFAULT "1:00:00",
+    end_time TIME NOT NULL,
     coach_id INTEGER NOT NULL,
     age_group_id INTEGER NOT NULL,
+    INDEX classes_timetable (weekday, age_group_id, time),
     FOREIGN KEY (coach_id) REFERENCES users (id)
 );
 
@@ -65,15 +74,57 @@ CREATE TABLE attendance (
     class_id INTEGER NOT NULL,
     class_date DATE NOT NULL,
     class_time TIME NOT NULL,
+    INDEX attendance_date (date),
+    INDEX attendance_user_date (user_id, date),
+    INDEX attendance_class_date (class_id, date),
+    INDEX attendance_class_date_time (class_date, class_time),
     FOREIGN KEY (user_id) REFERENCES users (id),
     FOREIGN KEY (class_id) REFERENCES classes (id)
 );
 
+CREATE TABLE attendance_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    date DATETIME NOT NULL,
+    class_id INTEGER NOT NULL,
+    class_date DATE NOT NULL,
+    class_time TIME NOT NULL,
+    INDEX attendance_archive_date (date),
+    INDEX attendance_archive_user_date (user_id, date),
+    INDEX attendance_archive_class_date (class_id, date),
+    INDEX attendance_archive_class_date_time (class_date, class_time),
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    FOREIGN KEY (class_id) REFERENCES classes (id)
+);
+
+CREATE TABLE class_attendance_daily (
+    class_id INTEGER NOT NULL,
+    class_date DATE NOT NULL,
+    attendees INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (class_id, class_date),
+    INDEX class_attendance_daily_date (class_date)
+);
+
+CREATE TABLE user_attendance_weekly (
+    user_id INTEGER NOT NULL,
+    week_start DATE NOT NULL,
+    attendances INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, week_start),
+    INDEX user_attendance_weekly_week (week_start)
+);
+
 CREATE TABLE password_resets (
 	id INT PRIMARY KEY AUTO_INCREMENT,
     user_id INT NOT NULL,
-    token TEXT NOT NULL,
+    token VARCHAR(128) NOT NULL,
     created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     valid_until TIMESTAMP NOT NULL,
+    INDEX password_resets_token (token),
     FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE TABLE schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
\ No newline at end of file
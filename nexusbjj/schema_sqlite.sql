@@ -0,0 +1,138 @@
+PRAGMA foreign_keys = OFF;
+DROP TABLE IF EXISTS age_groups;
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS classes;
+DROP TABLE IF EXISTS attendance;
+DROP TABLE IF EXISTS attendance_archive;
+DROP TABLE IF EXISTS memberships;
+DROP TABLE IF EXISTS password_resets;
+DROP TABLE IF EXISTS schema_migrations;
+DROP TABLE IF EXISTS class_attendance_daily;
+DROP TABLE IF EXISTS user_attendance_weekly;
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE age_groups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    min_age INTEGER NOT NULL,
+    max_age INTEGER NOT NULL
+);
+
+CREATE TABLE memberships (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    membership_type TEXT NOT NULL,
+    membership_description TEXT,
+    sessions_per_week INTEGER NOT NULL,
+    age_group_id INTEGER,
+    FOREIGN KEY (age_group_id) REFERENCES age_groups (id)
+);
+
+INSERT INTO memberships (membership_type, sessions_per_week)
+VALUES
+    ('pay per session', 0),
+    ('basic', 4),
+    ('intermediate', 6),
+    ('unlimited', 14);
+
+
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email VARCHAR(255) NOT NULL,
+    password TEXT NOT NULL,
+    first_name VARCHAR(255) NOT NULL,
+    last_name VARCHAR(255) NOT NULL,
+    mobile_number TEXT NOT NULL,
+    grade TEXT,
+    membership_id INTEGER NOT NULL,
+    admin TEXT NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+    last_access TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+    is_coach BOOLEAN NOT NULL DEFAULT false,
+    FOREIGN KEY (membership_id) REFERENCES memberships (id)
+);
+
+CREATE UNIQUE INDEX users_email ON users (email);
+CREATE INDEX users_name ON users (last_name, first_name);
+CREATE INDEX users_last_access ON users (last_access);
+
+CREATE TABLE classes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    class_name TEXT NOT NULL,
+    class_type TEXT NOT NULL,
+    weekday INTEGER NOT NULL,
+    time TIME NOT NULL,
+    duration TIME NOT NULL DEFAULT '1:00:00',
+    end_time TIME NOT NULL,
+    coach_id INTEGER NOT NULL,
+    age_group_id INTEGER NOT NULL,
+    FOREIGN KEY (coach_id) REFERENCES users (id)
+);
+
+CREATE INDEX classes_timetable ON classes (weekday, age_group_id, time);
+
+CREATE TABLE attendance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    date DATETIME NOT NULL DEFAULT (datetime('now', 'localtime')),
+    class_id INTEGER NOT NULL,
+    class_date DATE NOT NULL,
+    class_time TIME NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    FOREIGN KEY (class_id) REFERENCES classes (id)
+);
+
+CREATE INDEX attendance_date ON attendance (date);
+CREATE INDEX attendance_user_date ON attendance (user_id, date);
+CREATE INDEX attendance_class_date ON attendance (class_id, date);
+CREATE INDEX attendance_class_date_time ON attendance (class_date, class_time);
+
+CREATE TABLE attendance_archive (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    date DATETIME NOT NULL,
+    class_id INTEGER NOT NULL,
+    class_date DATE NOT NULL,
+    class_time TIME NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    FOREIGN KEY (class_id) REFERENCES classes (id)
+);
+
+CREATE INDEX attendance_archive_date ON attendance_archive (date);
+CREATE INDEX attendance_archive_user_date ON attendance_archive (user_id, date);
+CREATE INDEX attendance_archive_class_date ON attendance_archive (class_id, date);
+CREATE INDEX attendance_archive_class_date_time ON attendance_archive (class_date, class_time);
+
+CREATE TABLE class_attendance_daily (
+    class_id INTEGER NOT NULL,
+    class_date DATE NOT NULL,
+    attendees INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (class_id, class_date)
+);
+
+CREATE INDEX class_attendance_daily_date ON class_attendance_daily (class_date);
+
+CREATE TABLE user_attendance_weekly (
+    user_id INTEGER NOT NULL,
+    week_start DATE NOT NULL,
+    attendances INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, week_start)
+);
+
+CREATE INDEX user_attendance_weekly_week ON user_attendance_weekly (week_start);
+
+CREATE TABLE password_resets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    token VARCHAR(128) NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+    valid_until TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE INDEX password_resets_token ON password_resets (token);
+
+CREATE TABLE schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
@@ -0,0 +1,28 @@
+from flask import Response, current_app, render_template, stream_template
+
+
+def get_table(data, show_index=False):
+    # Jinja iterates plain tuples far faster than the Series that DataFrame.iterrows builds for every row
+    if data is None or len(data) == 0:
+        return {'table_columns': [], 'table_rows': []}
+
+    if isinstance(data, list):
+        # Row dicts straight from the cursor, for pages that have no other use for a DataFrame
+        columns = list(data[0])
+        return {'table_columns': columns, 'table_rows': [tuple(row[column] for column in columns) for row in data]}
+
+    columns = list(data.columns)
+    if show_index:
+        columns.insert(0, data.index.name or '')
+
+    return {'table_columns': columns, 'table_rows': list(data.itertuples(index=show_index, name=None))}
+
+
+def render_table(template, data, show_index=False, **context):
+    table = get_table(data, show_index)
+
+    # Large tables are streamed so that the first rows reach the browser while the rest render
+    if len(table['table_rows']) > current_app.config.get('STREAM_TABLE_ROWS', 1000):
+        return Response(stream_template(template, **table, **context))
+
+    return render_template(template, **table, **context)
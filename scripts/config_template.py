@@ -3,3 +3,48 @@ SECRET_KEY = os.urandom(32)
 DATABASE_HOST = '<host>'
 DATABASE_USER = 'webapp'
 DATABASE_PASS = '<password>'
+
+DATABASE_POOL_SIZE = 5
+
+# Optional read replica for reports; the user needs the REPLICATION CLIENT privilege to read its lag
+# DATABASE_REPLICA_HOST = '<replica host>'
+# DATABASE_REPLICA_USER and DATABASE_REPLICA_PASS default to the primary's
+# Reads fall back to the primary while the replica is more than this many seconds behind
+DATABASE_REPLICA_MAX_LAG = 5
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = 10
+# A session that writes reads from the primary for this many seconds afterwards
+DATABASE_REPLICA_READ_YOUR_WRITES = 10
+
+SMTP_USER = '<smtp user>'
+SMTP_PASS = '<smtp password>'
+SMTP_HOST = 'email-smtp.eu-west-2.amazonaws.com'
+SMTP_PORT = 587
+
+# Set DATABASE_BACKEND = 'sqlite' to run against a local file, e.g. for benchmarking
+DATABASE_BACKEND = 'mysql'
+# DATABASE_PATH = 'instance/nexusbjj.sqlite'
+
+# Requests only stamp last_access once per coalesce window, and the stamps are written at least every flush interval,
+# so last_access can trail a member's latest request by up to the sum of the two
+ACCESS_TIME_COALESCE_WINDOW = 60
+ACCESS_TIME_FLUSH_INTERVAL = 60
+ACCESS_TIME_BATCH_SIZE = 100
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+STREAM_TABLE_ROWS = 1000
+
+# Report pages are cached per worker; edits made through another worker show up after this many seconds
+REPORT_CACHE_TTL = 60
+# Each worker caches the timetable; changes made through another worker show up after this many seconds
+TIMETABLE_CACHE_TTL = 300
+# Likewise for membership types, age groups and coaches
+REFERENCE_CACHE_TTL = 300
+# And for the newest archived check-in; run archive-attendance outside opening hours, as reports can miss newly
+# archived rows for up to this plus REPORT_CACHE_TTL
+ARCHIVE_CACHE_TTL = 300
+
+# Queries slower than this are logged with their EXPLAIN plan
+SLOW_QUERY_MS = 500
+# Bearer token for scraping /reports/metrics without an admin session
+# METRICS_TOKEN = '<token>'
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Cold start benchmark: how long a fresh worker spends importing modules while building the app
+import os
+import re
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP = 'from nexusbjj import create_app; create_app({"SECRET_KEY": "import-time"})'
+# Only the reports that need them should pull these in
+DEFERRED_MODULES = ('pandas', 'numpy')
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--top', type=int, default=15, help='Number of slowest top-level packages to list')
+    parser.add_argument('-r', '--runs', type=int, default=5, help='Number of cold starts to measure; the fastest is reported')
+    parser.add_argument('--max-ms', type=float, help='Fail if importing takes longer than this many milliseconds')
+    return parser.parse_args()
+
+
+def measure_imports():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP], cwd=APP_ROOT, capture_output=True, text=True,
+                            check=True)
+    packages = {}
+
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+\d+ \| *([\w.]+)', line)
+        if not match:
+            continue
+        self_us, module = match.groups()
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+
+    return packages
+
+
+def main():
+    args = get_args()
+    runs = [measure_imports() for _ in range(args.runs)]
+    packages = min(runs, key=lambda run: sum(run.values()))
+    total_ms = sum(packages.values()) / 1000
+
+    print(f'{"Package":<30} {"Self (ms)":>10}')
+    for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f'{package:<30} {self_us / 1000:>10.1f}')
+    print(f'{"Total":<30} {total_ms:>10.1f}')
+
+    failures = [f'{module} is imported at start-up' for module in DEFERRED_MODULES if module in packages]
+    if args.max_ms is not None and total_ms > args.max_ms:
+        failures.append(f'Importing took {total_ms:.1f}ms, more than the {args.max_ms:.1f}ms budget')
+
+    for failure in failures:
+        print(failure)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,6 +10,7 @@ setup(
         'flask',
         'werkzeug',
         'pandas',
+        'numpy',
         'lipsum',
         'bs4',
         'lxml',
@@ -0,0 +1,65 @@
+import pytest
+from nexusbjj import create_app
+from nexusbjj import db as database
+
+
+def reset_worker_state():
+    # Pools and caches live for the life of a worker, so each test starts from a clean one
+    database._pool = None
+    database._replica_pool = None
+    database._schema_problems = None
+    database.access_times.pending.clear()
+    database.access_times.last_recorded.clear()
+    for cache in (database.user_cache, database.report_cache, database.reference_cache, database.archive_cache):
+        cache.clear()
+    database.timetable.invalidate()
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    apps = []
+
+    def make(**config):
+        reset_worker_state()
+        app = create_app({
+            'SECRET_KEY': 'test',
+            'DATABASE_BACKEND': 'sqlite',
+            'DATABASE_PATH': str(tmp_path / 'nexusbjj.sqlite'),
+            **config
+        })
+        if not apps:
+            runner = app.test_cli_runner()
+            runner.invoke(args=['init-db'])
+            runner.invoke(args=['seed-db', '--members', '20', '--weeks', '4'])
+        apps.append(app)
+        return app
+
+    yield make
+    reset_worker_state()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        yield database.get_db()
+
+
+@pytest.fixture
+def log_in():
+    def log_in(client, user_id):
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+        return client
+
+    return log_in
+
+
+@pytest.fixture
+def admin_client(app, log_in):
+    # The seeded coach is a read-write admin
+    return log_in(app.test_client(), 1)
@@ -0,0 +1,69 @@
+import sqlite3
+from datetime import datetime, timedelta
+import pytest
+from nexusbjj.db import explain_queries, get_week_start, report_cache
+
+
+@pytest.fixture
+def archive_before():
+    # The seeded attendance covers the four weeks before this one
+    return datetime.combine(get_week_start(datetime.today()) - timedelta(weeks=2), datetime.min.time())
+
+
+def get_all_attendance(db):
+    rows = db.get_attendance(from_date=datetime.today() - timedelta(weeks=10), to_date=datetime.today())
+    return sorted((row['user_id'], str(row['check_in_time'])) for row in rows)
+
+
+def move_to_archive(tmp_path, before):
+    # As archive-attendance would from its own process, leaving this worker's caches alone
+    connection = sqlite3.connect(tmp_path / 'nexusbjj.sqlite')
+    with connection:
+        connection.execute('INSERT INTO attendance_archive SELECT * FROM attendance WHERE date < ?', (str(before),))
+        connection.execute('DELETE FROM attendance WHERE date < ?', (str(before),))
+    connection.close()
+
+
+def test_archived_attendance_is_still_reported(db, archive_before):
+    attendance = get_all_attendance(db)
+    absentees = db.get_absentees(datetime.today())
+
+    assert db.archive_attendance(archive_before) > 0
+    db.execute('SELECT COUNT(*) hot FROM attendance WHERE date < %s', (archive_before,))
+    assert db.cursor.fetchone()['hot'] == 0
+
+    assert get_all_attendance(db) == attendance
+    assert db.get_absentees(datetime.today()) == absentees
+    assert all(row['last_class'] is not None for row in absentees)
+
+
+def test_ranges_after_the_archive_skip_it(db, archive_before):
+    db.archive_attendance(archive_before)
+    archive_end = db.get_archive_end()
+
+    query, params = db.build_attendance_query(archive_end + timedelta(seconds=1), datetime.today())
+    assert 'attendance_archive' not in query
+
+    query, params = db.build_attendance_query(archive_end, datetime.today())
+    assert 'attendance_archive' in query
+
+
+def test_archiving_by_another_process_is_seen(db, tmp_path, archive_before):
+    attendance = get_all_attendance(db)
+    move_to_archive(tmp_path, archive_before)
+    assert get_all_attendance(db) == attendance
+
+
+def test_report_pages_expire(admin_client, archive_before):
+    week_ago = (datetime.today() - timedelta(weeks=1)).date()
+    admin_client.get(f'/reports/attendance/custom?start_date={archive_before.date()}&end_date={archive_before.date()}')
+    admin_client.get(f'/reports/attendance/custom?start_date={week_ago}&end_date={datetime.today().date()}')
+
+    assert len(report_cache) == 2
+    assert all(expires is not None for value, expires in report_cache._entries.values())
+
+
+def test_explain_covers_the_archive(db, archive_before):
+    db.archive_attendance(archive_before)
+    tables = {step['table'] for step in explain_queries(db) if 'archived' in step['query']}
+    assert 'attendance_archive' in tables
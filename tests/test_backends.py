@@ -0,0 +1,24 @@
+import pytest
+from nexusbjj.backends import translate_params, translate_sql
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('SELECT * FROM users WHERE id = %s', 'SELECT * FROM users WHERE id = ?'),
+    ('SELECT CONCAT(first_name, " ", last_name) FROM users', "SELECT CONCAT(first_name, ' ', last_name) FROM users"),
+    ("SELECT '%s' FROM users WHERE id = %s", "SELECT '%s' FROM users WHERE id = ?"),
+    ('SELECT "it\'s" FROM users', "SELECT 'it''s' FROM users"),
+    ('SELECT id FROM users WHERE id = %s FOR UPDATE', 'SELECT id FROM users WHERE id = ?'),
+    ('SELECT DATE_SUB(class_date, INTERVAL WEEKDAY(class_date) DAY) FROM attendance',
+     "SELECT date(class_date, '-' || (WEEKDAY(class_date)) || ' days') FROM attendance"),
+])
+def test_translate_sql(query, expected):
+    assert translate_sql(query) == expected
+
+
+def test_translate_sql_upsert():
+    query = 'INSERT INTO t (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = b + VALUES(b)'
+    assert translate_sql(query) == 'INSERT INTO t (a, b) VALUES (?, ?) ON CONFLICT DO UPDATE SET b = b + excluded.b'
+
+
+def test_translate_params():
+    assert translate_params(('2026-01-02T10:00:00', 3, None)) == ('2026-01-02 10:00:00', 3, None)
@@ -0,0 +1,44 @@
+from nexusbjj import cache
+from nexusbjj.cache import TTLCache
+
+
+def test_get_and_set():
+    ttl_cache = TTLCache(maxsize=2)
+    ttl_cache.set('a', 1)
+
+    assert ttl_cache.get('a') == 1
+    assert ttl_cache.get('b', 'missing') == 'missing'
+    assert (ttl_cache.hits, ttl_cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    ttl_cache = TTLCache(maxsize=2)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2)
+    ttl_cache.get('a')
+    ttl_cache.set('c', 3)
+
+    assert ttl_cache.get('b') is None
+    assert ttl_cache.get('a') == 1
+    assert ttl_cache.evictions == 1
+
+
+def test_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache, 'monotonic', lambda: now[0])
+    ttl_cache = TTLCache(ttl=10)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2, ttl=60)
+
+    now[0] += 11
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.get('b') == 2
+
+
+def test_invalidate_where():
+    ttl_cache = TTLCache()
+    for key in range(5):
+        ttl_cache.set(key, key)
+
+    ttl_cache.invalidate_where(lambda key: key % 2)
+    assert sorted(ttl_cache._entries) == [0, 2, 4]
@@ -0,0 +1,40 @@
+import pytest
+from nexusbjj.db import decode_cursor, encode_cursor, USER_SORT_COLUMNS
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(['Member', '10', 11])
+    assert decode_cursor(cursor, 3) == ['Member', '10', 11]
+
+
+@pytest.mark.parametrize('cursor', [None, '', 'not base64!', encode_cursor([1, 2])])
+def test_invalid_cursor_is_ignored(cursor):
+    assert decode_cursor(cursor, 3) is None
+
+
+@pytest.mark.parametrize('sort', USER_SORT_COLUMNS)
+@pytest.mark.parametrize('descending', [False, True])
+def test_users_pages_cover_every_user_once(db, sort, descending):
+    db.execute('SELECT id FROM users')
+    expected = {row['id'] for row in db.cursor.fetchall()}
+    seen = []
+    pages = []
+    cursor = None
+
+    while True:
+        rows, next_cursor, previous_cursor = db.get_users_page(columns=('id',), sort=sort, descending=descending, cursor=cursor,
+                                                               limit=6)
+        pages.append((cursor, [row['id'] for row in rows], previous_cursor))
+        seen += [row['id'] for row in rows]
+        if next_cursor is None:
+            break
+        cursor = next_cursor
+
+    assert sorted(seen) == sorted(expected)
+    assert len(seen) == len(expected)
+
+    # Going back from the second page lands on the first page again
+    second_cursor, _, previous_cursor = pages[1]
+    rows, _, _ = db.get_users_page(columns=('id',), sort=sort, descending=descending, cursor=previous_cursor, backwards=True,
+                                   limit=6)
+    assert [row['id'] for row in rows] == pages[0][1]
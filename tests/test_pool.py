@@ -0,0 +1,77 @@
+import shutil
+import sqlite3
+import pytest
+from mysql.connector.errors import PoolError
+from nexusbjj import db as database
+from nexusbjj.backends import SQLiteBackend
+from nexusbjj.db import ConnectionPool, get_pool_size
+
+
+def test_pool_times_out_when_exhausted(tmp_path):
+    pool = ConnectionPool(size=1, timeout=0.1, backend=SQLiteBackend(), database=str(tmp_path / 'pool.sqlite'))
+    connection = pool.get_connection()
+
+    with pytest.raises(PoolError):
+        pool.get_connection()
+
+    pool.release(connection)
+    assert pool.get_connection() is connection
+    assert pool.stats()['timeouts'] == 1
+
+
+@pytest.mark.parametrize('config, size', [
+    ({}, 5),
+    ({'DATABASE_POOL_SIZE': 8}, 8),
+    ({'DATABASE_POOL_SIZE': 1}, 2),
+    ({'DATABASE_MAX_CONNECTIONS': 40, 'WORKERS': 4}, 10),
+    ({'DATABASE_MAX_CONNECTIONS': 4, 'WORKERS': 4}, 2),
+])
+def test_pool_size(config, size):
+    assert get_pool_size(config) == size
+
+
+def test_access_time_flush_does_not_need_a_second_connection(make_app, log_in):
+    # A pool of one connection is raised to two; the flush must still never take a second one from a request
+    app = make_app(DATABASE_POOL_SIZE=1, DATABASE_POOL_TIMEOUT=0.5, ACCESS_TIME_BATCH_SIZE=1)
+    client = log_in(app.test_client(), 1)
+
+    for _ in range(3):
+        assert client.get('/users').status_code == 200
+        assert client.get('/classes/').status_code == 200
+
+    assert database._pool.stats()['timeouts'] == 0
+    assert database._pool.stats()['open'] == 1
+    assert database._pool.stats()['in_use'] == 0
+    assert not database.access_times.pending
+
+
+def test_access_time_flush_does_not_pin_the_session_to_the_primary(make_app, log_in, tmp_path):
+    app = make_app()
+    for suffix in ('', '-wal', '-shm'):
+        source = tmp_path / f'nexusbjj.sqlite{suffix}'
+        if source.exists():
+            shutil.copy(source, tmp_path / f'replica.sqlite{suffix}')
+
+    app = make_app(DATABASE_REPLICA_PATH=str(tmp_path / 'replica.sqlite'), ACCESS_TIME_BATCH_SIZE=1)
+    client = log_in(app.test_client(), 1)
+    assert client.get('/reports/attendance/last-week').status_code == 200
+
+    with client.session_transaction() as session:
+        assert 'primary_until' not in session
+    assert not database.access_times.pending
+
+
+def test_streamed_csv_uses_one_connection(make_app, log_in, tmp_path):
+    app = make_app(DATABASE_POOL_SIZE=1, DATABASE_POOL_TIMEOUT=0.5)
+    client = log_in(app.test_client(), 1)
+    connection = sqlite3.connect(tmp_path / 'nexusbjj.sqlite')
+    first_day, last_day, attendances = connection.execute('SELECT MIN(class_date), MAX(class_date), COUNT(*) FROM attendance').fetchone()
+    connection.close()
+
+    response = client.get(f'/reports/csv?report=custom&start_date={first_day}&end_date={last_day}')
+    lines = response.get_data(as_text=True).splitlines()
+
+    assert response.status_code == 200
+    assert len(lines) == attendances + 1
+    assert database._pool.stats()['open'] == 1
+    assert database._pool.stats()['in_use'] == 0
@@ -0,0 +1,49 @@
+from datetime import date, datetime
+from nexusbjj.db import get_week_start
+from nexusbjj.routes.reports import get_excess_attendance
+
+
+def get_rollups(db):
+    # Removing a check-in can leave a zero count behind, which reads the same as no row
+    db.execute('SELECT class_id, class_date, attendees FROM class_attendance_daily')
+    daily = {(row['class_id'], str(row['class_date'])): row['attendees'] for row in db.cursor.fetchall() if row['attendees']}
+    db.execute('SELECT user_id, week_start, attendances FROM user_attendance_weekly')
+    weekly = {(row['user_id'], str(row['week_start'])): row['attendances'] for row in db.cursor.fetchall() if row['attendances']}
+    return daily, weekly
+
+
+def test_check_ins_keep_the_rollups_current(db):
+    db.execute('SELECT id, time FROM classes ORDER BY id LIMIT 2')
+    classes = [(row['id'], date.today().isoformat(), row['time']) for row in db.cursor.fetchall()]
+
+    db.check_in_many(2, classes)
+    db.remove_check_ins(2, classes[:1])
+    db.check_in_many(3, classes[1:])
+    checked_in = get_rollups(db)
+
+    db.rebuild_attendance_rollups()
+    assert get_rollups(db) == checked_in
+    assert checked_in[0][(classes[1][0], classes[1][1])] == 2
+    assert (classes[0][0], classes[0][1]) not in checked_in[0]
+
+
+def test_excess_attendance():
+    monday = get_week_start(datetime(2026, 3, 4))
+    next_monday = get_week_start(datetime(2026, 3, 11))
+    weekly_attendance = [
+        {'user_id': 1, 'full_name': 'Over Limit', 'week_start': monday, 'attendances': 4, 'sessions_per_week': 2},
+        {'user_id': 1, 'full_name': 'Over Limit', 'week_start': next_monday, 'attendances': 1, 'sessions_per_week': 2},
+        {'user_id': 2, 'full_name': 'Within Limit', 'week_start': monday, 'attendances': 2, 'sessions_per_week': 2},
+    ]
+
+    report = get_excess_attendance(weekly_attendance, datetime(2026, 3, 4), datetime(2026, 3, 12))
+
+    assert list(report.index) == ['Over Limit']
+    assert report.loc['Over Limit', ('sessions', 'weekly_average')] == 2.5
+    assert report.loc['Over Limit', ('sessions', 'limit')] == 2
+    assert list(report['attendance'].loc['Over Limit']) == [4, 1]
+
+
+def test_excess_attendance_report(admin_client):
+    response = admin_client.get('/reports/users/exceeding-membership-limit')
+    assert response.status_code == 200